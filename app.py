@@ -1,62 +1,79 @@
 import streamlit as st
-import google.generativeai as genai
+from streamlit.errors import StreamlitAPIException
 from dotenv import load_dotenv
 import os
-import speech_recognition as sr
 from audio_recorder_streamlit import audio_recorder
-import io
-import tempfile
-from gtts import gTTS
 import time
+from speech_pipeline import PlaybackCursor
+from conversation_store import get_conversation_store
+from engine import EngineConfig, VoiceEngine
+from personalities import PERSONALITIES
+from tts_cache import get_tts_cache
+from response_cache import get_response_cache
+from session_memory import get_memory_budget, recording_digest
+from tracing import get_tracer
+from rate_limit import get_scheduler
+from resilience import backend_stats
+from http_pool import get_http_pool
+from speech_to_text import get_stt_router
+from turns import TurnJob, get_worker_pool, speak_text, TRANSCRIBING, DONE
 
 # Load environment variables
 load_dotenv()
 
-# Configure Gemini API
-genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
-
-# Personality system prompts
-PERSONALITIES = {
-    "General Assistant": {
-        "name": "General Assistant",
-        "icon": "💬",
-        "prompt": "You are a helpful and friendly AI assistant. Speak naturally like a real person having a conversation. Keep responses conversational, warm, and engaging. Use casual language and contractions (like 'I'm', 'you're', 'let's'). Avoid overly formal or robotic language. Be concise but friendly, as if talking to a friend."
-    },
-    "Study Buddy": {
-        "name": "Study Buddy",
-        "icon": "📚",
-        "prompt": "You are a patient and encouraging study companion who talks like a supportive friend. Speak naturally and conversationally. Use everyday language, contractions, and a warm tone. Explain concepts clearly with relatable examples. Say things like 'Hey, let me help you understand this' or 'That's a great question!' Keep it friendly and approachable, not formal or robotic."
-    },
-    "Fitness Coach": {
-        "name": "Fitness Coach",
-        "icon": "💪",
-        "prompt": "You are an enthusiastic and motivating fitness coach who talks like an encouraging workout buddy. Speak naturally with energy and warmth. Use casual, motivating language like 'You've got this!' or 'Let's work on that together!' Keep it conversational and upbeat. Focus on safe practices and sustainable habits, but speak like a real person, not a formal trainer."
-    },
-    "Gaming Helper": {
-        "name": "Gaming Helper",
-        "icon": "🎮",
-        "prompt": "You are a knowledgeable and enthusiastic gaming buddy. Talk like you're chatting with a friend about games - casual, fun, and natural. Use gaming slang when appropriate. Say things like 'Dude, here's what you should try' or 'That's awesome!' Keep it relaxed and conversational. Share tips and strategies like you're talking over voice chat with a friend."
-    }
-}
-
-# Initialize session state
-if "messages" not in st.session_state:
-    st.session_state.messages = []
-
-if "personality" not in st.session_state:
-    st.session_state.personality = "General Assistant"
-
-if "last_audio_bytes" not in st.session_state:
-    st.session_state.last_audio_bytes = None
+# Most recent messages rendered individually; older ones load on demand
+CHAT_WINDOW = int(os.getenv("CHAT_WINDOW_MESSAGES", "20"))
+# Earlier messages are rendered, and cached, in pages of this many
+HISTORY_PAGE_SIZE = 50
+
+# Initialize session state; the engine holds the conversation itself. With a
+# conversation store, the session id in the URL lets any server process (or
+# this one after a restart) pick the conversation up again.
+if "engine" not in st.session_state:
+    store = get_conversation_store()
+    session_id = st.query_params.get("session") if store else None
+    st.session_state.engine = VoiceEngine(EngineConfig.from_env(session_id=session_id), store=store)
+    if store:
+        st.query_params["session"] = st.session_state.engine.session_id
+        # Don't replay the last reply of a resumed conversation on load
+        st.session_state.tts_autoplayed = {len(st.session_state.engine.messages) - 1}
+
+if "last_audio_digest" not in st.session_state:
+    st.session_state.last_audio_digest = None
 
 if "tts_audio" not in st.session_state:
-    st.session_state.tts_audio = {}
+    # Reply audio by message index, within the session and global memory budgets
+    st.session_state.tts_audio = get_memory_budget().new_session()
+
+if "traces" not in st.session_state:
+    st.session_state.traces = []
+
+if "show_debug_panel" not in st.session_state:
+    st.session_state.show_debug_panel = False
+
+if "active_turn" not in st.session_state:
+    st.session_state.active_turn = None
+
+if "turn_notices" not in st.session_state:
+    st.session_state.turn_notices = []
+
+if "tts_autoplayed" not in st.session_state:
+    st.session_state.tts_autoplayed = set()
+
+if "tts_failed" not in st.session_state:
+    st.session_state.tts_failed = set()  # Replies whose TTS failed; not retried
+
+if "audio_job" not in st.session_state:
+    st.session_state.audio_job = None  # (message index, job) resynthesizing dropped audio
 
 if "voice_only_mode" not in st.session_state:
     st.session_state.voice_only_mode = False
 
-if "response_length" not in st.session_state:
-    st.session_state.response_length = "Medium"
+if "history_extra" not in st.session_state:
+    st.session_state.history_extra = 0  # Earlier messages loaded above the window
+
+if "history_markdown" not in st.session_state:
+    st.session_state.history_markdown = {}  # Page number -> rendered message blocks
 
 # Page configuration
 st.set_page_config(
@@ -352,28 +369,167 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+def clear_chat_view():
+    """Forget what the page keeps about the conversation (not the conversation)."""
+    st.session_state.tts_audio.clear()  # Clear cached audio too
+    st.session_state.tts_autoplayed = set()
+    st.session_state.tts_failed = set()
+    st.session_state.audio_job = None
+    st.session_state.history_extra = 0
+    st.session_state.history_markdown = {}
+    # A turn still running belongs to the old conversation; stop showing it
+    st.session_state.active_turn = None
+    st.session_state.turn_playback = None
+    st.session_state.turn_notices = []
+
+def clear_chat():
+    st.session_state.engine.reset()
+    clear_chat_view()
+
+def select_personality():
+    # Changing personality resets the conversation; only the page is left to clear
+    st.session_state.engine.set_personality(st.session_state.personality_select)
+    clear_chat_view()
+
+def set_response_length(length):
+    st.session_state.engine.set_response_length(length)
+
+@st.fragment
+def response_length_controls():
+    """Length buttons; clicking one only reruns this fragment."""
+    col1, col2, col3 = st.columns(3)
+
+    with col1:
+        st.button("📝 Short", use_container_width=True, type="primary" if st.session_state.engine.response_length == "Short" else "secondary",
+                  on_click=set_response_length, args=("Short",))
+
+    with col2:
+        st.button("💬 Medium", use_container_width=True, type="primary" if st.session_state.engine.response_length == "Medium" else "secondary",
+                  on_click=set_response_length, args=("Medium",))
+
+    with col3:
+        st.button("📖 Long", use_container_width=True, type="primary" if st.session_state.engine.response_length == "Long" else "secondary",
+                  on_click=set_response_length, args=("Long",))
+
+    # Display current selection with an icon
+    st.markdown(f"""
+    <div style='text-align: center; margin-top: 0.5rem; padding: 0.5rem; background: rgba(102, 126, 234, 0.2); border-radius: 8px;'>
+        <span style='color: #667eea; font-weight: 600;'>✨ {st.session_state.engine.response_length}</span>
+        <span style='color: #a0aec0;'> responses</span>
+    </div>
+    """, unsafe_allow_html=True)
+
+@st.fragment
+def performance_panels():
+    """Cache, upstream API and latency stats; toggling the debug panel only reruns this fragment."""
+    with st.expander("TTS cache"):
+        cache_stats = get_tts_cache().stats()
+        st.caption(
+            f"Hits: {cache_stats['hits'] + cache_stats['disk_hits']} · "
+            f"Misses: {cache_stats['misses']} · "
+            f"Shared: {cache_stats['coalesced']} · "
+            f"Evictions: {cache_stats['evictions']}"
+        )
+        st.caption(f"{cache_stats['entries']} clips, {cache_stats['bytes'] / 1024 / 1024:.1f} MB")
+
+    response_cache = get_response_cache()
+    if response_cache:
+        with st.expander("Response cache"):
+            response_stats = response_cache.stats()
+            st.caption(
+                f"Hits: {response_stats['hits']} · Misses: {response_stats['misses']} · "
+                f"Expired: {response_stats['expired']} · {response_stats['entries']} replies"
+            )
+
+    with st.expander("Upstream APIs"):
+        for backend, limit_stats in get_scheduler().stats().items():
+            st.caption(
+                f"{backend}: queued {limit_stats['queue_depth']} (max {limit_stats['max_queue_depth']}) · "
+                f"avg wait {limit_stats['avg_wait_ms']:.0f} ms · "
+                f"throttled {limit_stats['throttled']}"
+            )
+        for backend, health in backend_stats().items():
+            p95 = f"{health['p95_ms']} ms" if health['p95_ms'] is not None else "n/a"
+            st.caption(
+                f"{backend} circuit: {health['state']} · p95 {p95} · "
+                f"hedged {health['hedges']} · failed fast {health['rejected']}"
+            )
+        for engine, engine_stats in get_stt_router().stats().items():
+            p50 = f"{engine_stats['p50_ms']} ms" if engine_stats['p50_ms'] is not None else "n/a"
+            st.caption(
+                f"STT {engine}: {engine_stats['calls']} calls · {engine_stats['failures']} failed · p50 {p50}"
+            )
+        http_stats = get_http_pool().stats()
+        st.caption(
+            f"HTTP: {http_stats['requests']} requests over {http_stats['connections']} connections "
+            f"({http_stats['reused']} reused)"
+        )
+
+    with st.expander("Memory"):
+        session_stats = st.session_state.tts_audio.stats()
+        st.caption(
+            f"This session: {session_stats['audio_bytes'] / 1024 / 1024:.1f} MB audio in {session_stats['clips']} clips · "
+            f"{session_stats['message_bytes'] / 1024:.0f} KB messages · "
+            f"budget {session_stats['budget_bytes'] / 1024 / 1024:.0f} MB · "
+            f"evicted {session_stats['evictions']}"
+        )
+        memory_stats = get_memory_budget().stats()
+        st.caption(
+            f"All sessions ({memory_stats['sessions']}): "
+            f"{memory_stats['audio_bytes'] / 1024 / 1024:.1f} MB audio · "
+            f"{memory_stats['message_bytes'] / 1024 / 1024:.1f} MB messages · "
+            f"budget {memory_stats['budget_bytes'] / 1024 / 1024:.0f} MB · "
+            f"evicted {memory_stats['evictions']}"
+        )
+        st.table([
+            {
+                "session": rank,
+                "audio (MB)": round(largest["audio_bytes"] / 1024 / 1024, 2),
+                "messages (KB)": round(largest["message_bytes"] / 1024),
+                "clips": largest["clips"],
+            }
+            for rank, largest in enumerate(get_memory_budget().largest_sessions(), start=1)
+        ])
+        conversation_store = get_conversation_store()
+        if conversation_store:
+            store_stats = conversation_store.stats()
+            st.caption(
+                f"Stored: {store_stats['sessions']} conversations · {store_stats['messages']} messages · "
+                f"{store_stats['bytes'] / 1024 / 1024:.1f} MB on disk"
+            )
+
+    st.session_state.show_debug_panel = st.checkbox(
+        "Show latency debug panel",
+        value=st.session_state.show_debug_panel,
+        help="Show where time went in recent turns, one span per pipeline stage."
+    )
+    if st.session_state.show_debug_panel:
+        for record in reversed(st.session_state.traces):
+            with st.expander(f"{record['kind'].title()} turn {record['turn_id']} · {record['total_ms']:.0f} ms"):
+                st.table([
+                    {"span": span["name"], "start (ms)": span["start_ms"], "duration (ms)": span["duration_ms"]}
+                    for span in record["spans"]
+                ])
+
 # Sidebar
 with st.sidebar:
     st.markdown("<h1 style='text-align: center; color: #667eea; font-size: 2rem;'>🤖 Voice AI</h1>", unsafe_allow_html=True)
     st.markdown("<p style='text-align: center; color: #a0aec0; margin-top: -10px;'>Your Intelligent Assistant</p>", unsafe_allow_html=True)
     st.markdown("---")
 
-    # Personality selection
+    # Personality selection; the callback runs before the rerun, so there's
+    # no need for a second pass with st.rerun()
     st.subheader("Choose Personality")
-    selected_personality = st.selectbox(
+    st.selectbox(
         "Select AI personality:",
         options=list(PERSONALITIES.keys()),
-        index=list(PERSONALITIES.keys()).index(st.session_state.personality)
+        index=list(PERSONALITIES.keys()).index(st.session_state.engine.personality),
+        key="personality_select",
+        on_change=select_personality
     )
 
-    # Update personality if changed
-    if selected_personality != st.session_state.personality:
-        st.session_state.personality = selected_personality
-        st.session_state.messages = []  # Clear chat history when personality changes
-        st.rerun()
-
     # Display personality info
-    current_personality = PERSONALITIES[st.session_state.personality]
+    current_personality = PERSONALITIES[st.session_state.engine.personality]
     st.info(f"{current_personality['icon']} **{current_personality['name']}**")
 
     st.markdown("---")
@@ -430,30 +586,7 @@ with st.sidebar:
     </style>
     """, unsafe_allow_html=True)
 
-    col1, col2, col3 = st.columns(3)
-
-    with col1:
-        if st.button("📝 Short", use_container_width=True, type="primary" if st.session_state.response_length == "Short" else "secondary"):
-            st.session_state.response_length = "Short"
-            st.rerun()
-
-    with col2:
-        if st.button("💬 Medium", use_container_width=True, type="primary" if st.session_state.response_length == "Medium" else "secondary"):
-            st.session_state.response_length = "Medium"
-            st.rerun()
-
-    with col3:
-        if st.button("📖 Long", use_container_width=True, type="primary" if st.session_state.response_length == "Long" else "secondary"):
-            st.session_state.response_length = "Long"
-            st.rerun()
-
-    # Display current selection with an icon
-    st.markdown(f"""
-    <div style='text-align: center; margin-top: 0.5rem; padding: 0.5rem; background: rgba(102, 126, 234, 0.2); border-radius: 8px;'>
-        <span style='color: #667eea; font-weight: 600;'>✨ {st.session_state.response_length}</span>
-        <span style='color: #a0aec0;'> responses</span>
-    </div>
-    """, unsafe_allow_html=True)
+    response_length_controls()
 
     st.markdown("---")
 
@@ -464,157 +597,58 @@ with st.sidebar:
         value=st.session_state.voice_only_mode,
         help="When enabled, AI will respond with voice only (no text). When disabled, AI responds with text and voice."
     )
+    vad_stats = st.session_state.engine.vad_stats
+    st.caption(
+        f"Silence trimmed: {vad_stats['trimmed_ms'] / 1000:.1f}s · "
+        f"Empty recordings skipped: {vad_stats['rejected']}"
+    )
 
-    st.markdown("---")
-    if st.button("Clear Chat History"):
-        st.session_state.messages = []
-        st.session_state.tts_audio = {}  # Clear cached audio too
-        st.rerun()
-
-# Function to process voice input
-def transcribe_audio(audio_bytes):
-    """Convert audio bytes to text using speech recognition."""
-    temp_wav = None
-    try:
-        recognizer = sr.Recognizer()
-
-        # Adjust for ambient noise
-        recognizer.energy_threshold = 4000
-        recognizer.dynamic_energy_threshold = True
-
-        if not audio_bytes or len(audio_bytes) == 0:
-            return None
-
-        # Create temporary file and write audio bytes directly
-        temp_file = tempfile.NamedTemporaryFile(suffix=".wav", delete=False)
-        temp_wav = temp_file.name
-        temp_file.write(audio_bytes)
-        temp_file.close()
-
-        # Verify file exists and has content
-        if not os.path.exists(temp_wav) or os.path.getsize(temp_wav) == 0:
-            st.error("Failed to create audio file")
-            return None
-
-        # Read with speech recognition
-        with sr.AudioFile(temp_wav) as source:
-            # Adjust for ambient noise
-            recognizer.adjust_for_ambient_noise(source, duration=0.5)
-            audio_data = recognizer.record(source)
-
-        # Use Google Speech Recognition with language options
-        text = recognizer.recognize_google(
-            audio_data,
-            language="en-US",
-            show_all=False
-        )
-        return text
-
-    except sr.UnknownValueError:
-        st.error("Could not understand audio. Please speak more clearly.")
-        return None
-    except sr.RequestError as e:
-        st.error(f"Speech recognition error: {str(e)}. Please check your internet connection.")
-        return None
-    except Exception as e:
-        st.error(f"Error processing audio: {str(e)}")
-        return None
-    finally:
-        # Clean up temp file
-        if temp_wav:
-            try:
-                if os.path.exists(temp_wav):
-                    os.remove(temp_wav)
-            except Exception:
-                pass  # Ignore cleanup errors
-
-# Function to generate TTS audio
-def generate_tts_audio(text, message_index):
-    """Generate text-to-speech audio for given text."""
-    try:
-        # Check if audio already exists for this message
-        if message_index in st.session_state.tts_audio:
-            return st.session_state.tts_audio[message_index]
-
-        # Retry logic for rate limiting
-        max_retries = 3
-        retry_delay = 2  # seconds
-
-        for attempt in range(max_retries):
-            try:
-                # Generate TTS audio with natural voice settings
-                # Use a more conversational speaking style
-                tts = gTTS(text=text, lang='en', slow=False, tld='com')
-
-                # Save to BytesIO object
-                audio_bytes = io.BytesIO()
-                tts.write_to_fp(audio_bytes)
-                audio_bytes.seek(0)
-
-                # Store in session state
-                audio_data = audio_bytes.read()
-                st.session_state.tts_audio[message_index] = audio_data
-
-                return audio_data
-            except Exception as e:
-                if "429" in str(e) and attempt < max_retries - 1:
-                    # Rate limit error, wait and retry
-                    time.sleep(retry_delay * (attempt + 1))
-                    continue
-                else:
-                    raise e
-
-    except Exception as e:
-        if "429" in str(e):
-            st.warning("TTS rate limit reached. Audio generation temporarily unavailable. Text response is still available.")
-        else:
-            st.error(f"TTS Error: {str(e)}")
-        return None
-
-# Function to generate AI response with streaming
-def generate_ai_response_stream(prompt):
-    """Generate AI response with streaming for faster feedback."""
-    try:
-        # Build system instruction with response length guidance
-        length_instructions = {
-            "Short": "IMPORTANT: Keep responses VERY brief - aim for 1-3 sentences maximum. Be direct and concise.",
-            "Medium": "Keep responses moderate - around 3-5 sentences. Balance brevity with completeness.",
-            "Long": "Provide detailed, comprehensive responses - 6+ sentences. Include explanations, examples, and context."
-        }
-
-        base_prompt = PERSONALITIES[st.session_state.personality]["prompt"]
-        full_prompt = f"{base_prompt}\n\nResponse Length Guideline: {length_instructions[st.session_state.response_length]}"
-
-        # Create model with system instruction based on personality
-        model = genai.GenerativeModel(
-            'gemini-2.5-flash',
-            system_instruction=full_prompt
-        )
-
-        # Build conversation history for context
-        chat_history = []
-        for msg in st.session_state.messages[:-1]:  # Exclude the last message (current user input)
-            chat_history.append({
-                "role": "user" if msg["role"] == "user" else "model",
-                "parts": [msg["content"]]
-            })
-
-        # Start chat session with history
-        chat = model.start_chat(history=chat_history)
-
-        # Stream the response
-        response = chat.send_message(prompt, stream=True)
-
-        full_response = ""
-        for chunk in response:
-            if chunk.text:
-                full_response += chunk.text
-
-        return full_response
+    performance_panels()
 
-    except Exception as e:
-        error_msg = f"Error: {str(e)}"
-        return error_msg
+    st.markdown("---")
+    st.button("Clear Chat History", on_click=clear_chat)
+
+def stored_reply_audio(message_index):
+    """Audio for a reply from session memory or the conversation store, if kept."""
+    # It may have been evicted, or this session may have been resumed from the store
+    audio_data = st.session_state.tts_audio.get_audio(message_index)
+    if audio_data is None:
+        audio_data = st.session_state.engine.reply_audio(message_index)
+        if audio_data is not None:
+            st.session_state.tts_audio.put_audio(message_index, audio_data)
+    return audio_data
+
+def request_reply_audio(text, message_index):
+    """Synthesize a reply's missing audio on a worker.
+
+    TTS, and its rate limit backoff, never runs on the script thread.
+    """
+    if message_index in st.session_state.tts_failed or st.session_state.audio_job is not None:
+        return
+    job = TurnJob("speech", prompt=text)
+    if get_worker_pool().submit(job, speak_text):
+        st.session_state.audio_job = (message_index, job)
+
+@st.fragment(run_every=0.5)
+def show_reply_audio_job():
+    """Wait for resynthesized reply audio, then rerun to show its player."""
+    if st.session_state.audio_job is None:
+        # Cleared with the chat; the next full run stops this fragment
+        return
+    message_index, job = st.session_state.audio_job
+    snapshot = job.snapshot()
+    if snapshot["state"] != DONE:
+        st.caption("🔊 Preparing audio...")
+        return
+
+    st.session_state.audio_job = None
+    if snapshot["audio"] and len(st.session_state.engine.messages) > message_index:
+        st.session_state.tts_audio.put_audio(message_index, snapshot["audio"])
+        st.session_state.engine.save_reply_audio(message_index, snapshot["audio"])
+    else:
+        st.session_state.tts_failed.add(message_index)
+        st.session_state.turn_notices = snapshot["notices"]
+    st.rerun()
 
 # Main chat interface with beautiful animated header
 st.markdown(f"""
@@ -649,90 +683,232 @@ st.markdown(f"""
 </style>
 
 <div class='hero-header'>
-    <div class='hero-icon'>{PERSONALITIES[st.session_state.personality]['icon']}</div>
-    <h2 style='color: white; margin: 1rem 0 0.5rem 0; font-weight: 700; font-size: 2.2rem;'>{st.session_state.personality}</h2>
+    <div class='hero-icon'>{PERSONALITIES[st.session_state.engine.personality]['icon']}</div>
+    <h2 style='color: white; margin: 1rem 0 0.5rem 0; font-weight: 700; font-size: 2.2rem;'>{st.session_state.engine.personality}</h2>
     <p style='color: rgba(255, 255, 255, 0.9); margin: 0; font-size: 1.15rem; font-weight: 500;'>✨ Powered by Google Gemini AI ✨</p>
 </div>
 """, unsafe_allow_html=True)
 
-# Display chat messages
-for i, message in enumerate(st.session_state.messages):
-    # In voice-only mode, skip displaying text for assistant messages
-    if not (st.session_state.voice_only_mode and message["role"] == "assistant"):
-        with st.chat_message(message["role"]):
-            st.markdown(message["content"])
-
-    # Display audio player for assistant messages (outside chat_message container)
-    if message["role"] == "assistant":
-        # Only generate TTS for the latest message to improve performance
-        is_latest = i == len(st.session_state.messages) - 1
-
-        if is_latest:
-            audio_data = generate_tts_audio(message["content"], i)
-            if audio_data:
-                # Always auto-play the latest message
-                st.audio(audio_data, format='audio/mp3', autoplay=True)
-
-# Voice input section
-st.markdown("""
-<div style='background: rgba(255, 255, 255, 0.15); padding: 1.5rem; border-radius: 15px; margin: 1rem 0;'>
-    <h3 style='color: white; margin-top: 0;'>🎤 Voice Input</h3>
-    <p style='color: rgba(255, 255, 255, 0.9); margin-bottom: 1rem;'>Click the microphone to record your message</p>
-</div>
-""", unsafe_allow_html=True)
-audio_bytes = audio_recorder(
-    text="",
-    recording_color="#e74c3c",
-    neutral_color="#3498db",
-    icon_name="microphone",
-    icon_size="2x",
-    key="audio_recorder"
-)
-
-# Check if we have new audio and we're not currently processing
-if audio_bytes:
-    # Only process if this is different from the last recording
-    if audio_bytes != st.session_state.last_audio_bytes:
-        # Store this recording to prevent reprocessing
-        st.session_state.last_audio_bytes = audio_bytes
-
-        with st.spinner("Transcribing audio..."):
-            transcribed_text = transcribe_audio(audio_bytes)
-
-        if transcribed_text:
-            # Add user message to chat history
-            st.session_state.messages.append({"role": "user", "content": transcribed_text})
-
-            # Generate AI response without displaying (will be shown after rerun)
-            with st.spinner("Generating response..."):
-                ai_response = generate_ai_response_stream(transcribed_text)
-
-            # Add assistant message to history
-            st.session_state.messages.append({"role": "assistant", "content": ai_response})
+def load_earlier_messages():
+    st.session_state.history_extra += CHAT_WINDOW
+
+def history_page(page):
+    """Rendered blocks for the messages on one page of ``HISTORY_PAGE_SIZE``.
+
+    Messages are only ever appended, so a page is rebuilt only while it is
+    still filling up; the others are rendered once.
+    """
+    messages = st.session_state.engine.messages
+    first = page * HISTORY_PAGE_SIZE
+    count = min(len(messages) - first, HISTORY_PAGE_SIZE)
+    cache = st.session_state.history_markdown
+    if page not in cache or len(cache[page]) < count:
+        cache[page] = [
+            (message["role"], f"**{'🧑 You' if message['role'] == 'user' else '🤖 Assistant'}:** {message['content']}")
+            for message in messages[first:first + count]
+        ]
+    return cache[page]
+
+def earlier_messages_markdown(start, end):
+    """Messages ``start:end`` as a single markdown block, from cached pages."""
+    blocks = []
+    for page in range(start // HISTORY_PAGE_SIZE, (end - 1) // HISTORY_PAGE_SIZE + 1):
+        first = page * HISTORY_PAGE_SIZE
+        for role, block in history_page(page)[max(start - first, 0):end - first]:
+            if role == "user" or not st.session_state.voice_only_mode:
+                blocks.append(block)
+    return "\n\n---\n\n".join(blocks)
+
+def show_history():
+    """Render the most recent messages, with older ones behind "Load earlier"."""
+    messages = st.session_state.engine.messages
+    window_start = max(len(messages) - CHAT_WINDOW, 0)
+    earlier_start = max(window_start - st.session_state.history_extra, 0)
+
+    if earlier_start > 0:
+        st.button(f"⬆️ Load earlier messages ({earlier_start} more)", on_click=load_earlier_messages)
+    if earlier_start < window_start:
+        with st.container(border=True):
+            st.markdown(earlier_messages_markdown(earlier_start, window_start))
+
+    # One read for the whole window when the conversation is stored
+    for i, message in enumerate(messages[window_start:], start=window_start):
+        # In voice-only mode, skip displaying text for assistant messages
+        if not (st.session_state.voice_only_mode and message["role"] == "assistant"):
+            with st.chat_message(message["role"]):
+                st.markdown(message["content"])
+
+        # Display audio player for assistant messages (outside chat_message container)
+        if message["role"] == "assistant":
+            # Only generate TTS for the latest message to improve performance
+            is_latest = i == len(messages) - 1
+
+            if is_latest:
+                audio_data = stored_reply_audio(i)
+                if audio_data is None:
+                    request_reply_audio(message["content"], i)
+                else:
+                    # Auto-play the latest message unless it was already spoken while streaming
+                    autoplay = i not in st.session_state.tts_autoplayed
+                    st.session_state.tts_autoplayed.add(i)
+                    st.audio(audio_data.data, format=audio_data.mime, autoplay=autoplay)
+
+def start_turn_trace(kind, render_started, history_rendered):
+    """Start tracing a turn from the beginning of this (fragment) run."""
+    trace = get_tracer().start_turn(kind, started=render_started)
+    trace.add("render.history", render_started, history_rendered)
+    return trace
+
+def submit_turn(kind, render_times, prompt=None, audio_bytes=None):
+    """Hand a turn to the background worker pool; returns True if it was accepted."""
+    render_started, history_rendered = render_times
+    trace = start_turn_trace(kind, render_started, history_rendered)
+    job = TurnJob(kind, prompt=prompt, audio_bytes=audio_bytes, trace=trace)
+    if not st.session_state.engine.submit(job, get_worker_pool()):
+        st.warning("The assistant is busy right now. Please try again in a moment.")
+        return False
+    st.session_state.active_turn = job
+    st.session_state.turn_playback = PlaybackCursor()
+    job.trace.add("render.submit", render_started, time.perf_counter())
+    return True
+
+def rerun_chat():
+    """Rerun just the chat region (or the whole app if this is a full run)."""
+    try:
+        st.rerun(scope="fragment")
+    except StreamlitAPIException:
+        st.rerun()
 
-            # Rerun to display the new messages
-            st.rerun()
-else:
-    # No audio - reset to allow new recordings
-    if st.session_state.last_audio_bytes is not None:
-        st.session_state.last_audio_bytes = None
+def finish_turn(job, snapshot):
+    """Move a finished turn into the chat history."""
+    message_index = st.session_state.engine.record(snapshot)
+    st.session_state.tts_audio.update_messages(st.session_state.engine.resident_messages())
+    if message_index is not None and snapshot["audio"]:
+        st.session_state.tts_audio.put_audio(message_index, snapshot["audio"])
+        st.session_state.tts_autoplayed.add(message_index)
+    elif message_index is not None:
+        # The turn already reported why there is no audio; don't try again
+        st.session_state.tts_failed.add(message_index)
+
+    # Notices are re-shown below the conversation after the rerun
+    st.session_state.turn_notices = snapshot["notices"]
+    st.session_state.active_turn = None
+
+    playback = st.session_state.turn_playback
+    if playback.first_played is not None:
+        job.trace.add("turn.first_audio", job.trace.started, playback.first_played)
+    job.trace.add("turn.complete", job.trace.started, time.perf_counter())
+    st.session_state.traces = (st.session_state.traces + [get_tracer().finish(job.trace)])[-10:]
+
+def show_notices(notices):
+    for level, message in notices:
+        if level == "warning":
+            st.warning(message)
+        else:
+            st.error(message)
+
+@st.fragment(run_every=0.3)
+def show_active_turn():
+    """Render the in-flight turn, polling the worker for partial results."""
+    job = st.session_state.active_turn
+    if job is None:
+        return
+    snapshot = job.snapshot()
+
+    if snapshot["transcript"]:
+        with st.chat_message("user"):
+            st.markdown(snapshot["transcript"])
+    if snapshot["state"] == TRANSCRIBING:
+        st.caption("🎧 Transcribing audio...")
+    elif snapshot["state"] != DONE and not snapshot["reply"]:
+        st.caption("💭 Generating response...")
+
+    if snapshot["reply"] and not st.session_state.voice_only_mode:
+        with st.chat_message("assistant"):
+            cursor = "" if snapshot["state"] == DONE else "▌"
+            st.markdown(snapshot["reply"] + cursor)
+
+    # Play the sentence audio back to back as segments arrive
+    playback = st.session_state.turn_playback
+    segments = snapshot["segments"]
+    playing = playback.advance(segments)
+    if playing >= 0:
+        st.audio(segments[playing].data, format=segments[playing].mime, autoplay=True)
+    show_notices(snapshot["notices"])
+
+    # Wait for the last sentence to finish playing before the rerun replaces
+    # this player with the message's own audio. This is a full rerun, since
+    # the sidebar's stats and latency panel also show the finished turn.
+    if snapshot["state"] == DONE and (not segments or playback.finished(segments)):
+        finish_turn(job, snapshot)
+        st.rerun(scope="app")
+
+@st.fragment
+def chat_region():
+    """Conversation, in-flight turn and both inputs.
+
+    Sending a message only reruns this fragment, not the CSS, header and
+    sidebar around it.
+    """
+    render_started = time.perf_counter()
+    show_history()
+    render_times = (render_started, time.perf_counter())
+    # Only poll while a reply's audio is being synthesized again
+    if st.session_state.audio_job is not None:
+        show_reply_audio_job()
+
+    # New turns are streamed here, directly below the existing conversation
+    if st.session_state.active_turn is not None:
+        show_active_turn()
+    elif st.session_state.turn_notices:
+        show_notices(st.session_state.turn_notices)
+        st.session_state.turn_notices = []
+
+    # Voice input section
+    st.markdown("""
+    <div style='background: rgba(255, 255, 255, 0.15); padding: 1.5rem; border-radius: 15px; margin: 1rem 0;'>
+        <h3 style='color: white; margin-top: 0;'>🎤 Voice Input</h3>
+        <p style='color: rgba(255, 255, 255, 0.9); margin-bottom: 1rem;'>Click the microphone to record your message</p>
+    </div>
+    """, unsafe_allow_html=True)
+    audio_bytes = audio_recorder(
+        text="",
+        recording_color="#e74c3c",
+        neutral_color="#3498db",
+        icon_name="microphone",
+        icon_size="2x",
+        key="audio_recorder"
+    )
 
-st.markdown("""
-<div style='background: rgba(255, 255, 255, 0.15); padding: 1.5rem; border-radius: 15px; margin: 2rem 0 1rem 0;'>
-    <h3 style='color: white; margin-top: 0;'>⌨️ Text Input</h3>
-    <p style='color: rgba(255, 255, 255, 0.9); margin-bottom: 0;'>Or type your message below</p>
-</div>
-""", unsafe_allow_html=True)
+    # Check if we have new audio and we're not currently processing
+    if audio_bytes:
+        # Only process if this is different from the last recording; only its
+        # digest is kept, not the recording itself
+        digest = recording_digest(audio_bytes)
+        if digest != st.session_state.last_audio_digest:
+            # Remember this recording to prevent reprocessing
+            st.session_state.last_audio_digest = digest
+
+            if st.session_state.active_turn is not None:
+                st.info("Still working on your previous message. Please record again once it's done.")
+            else:
+                if submit_turn("voice", render_times, audio_bytes=audio_bytes):
+                    rerun_chat()
+    else:
+        # No audio - reset to allow new recordings
+        if st.session_state.last_audio_digest is not None:
+            st.session_state.last_audio_digest = None
 
-# Chat input
-if prompt := st.chat_input("Type your message here..."):
-    # Add user message to chat history
-    st.session_state.messages.append({"role": "user", "content": prompt})
+    st.markdown("""
+    <div style='background: rgba(255, 255, 255, 0.15); padding: 1.5rem; border-radius: 15px; margin: 2rem 0 1rem 0;'>
+        <h3 style='color: white; margin-top: 0;'>⌨️ Text Input</h3>
+        <p style='color: rgba(255, 255, 255, 0.9); margin-bottom: 0;'>Or type your message below</p>
+    </div>
+    """, unsafe_allow_html=True)
 
-    # Generate AI response without displaying (will be shown after rerun)
-    with st.spinner("Generating response..."):
-        ai_response = generate_ai_response_stream(prompt)
+    # Chat input (disabled while a turn is still running)
+    if prompt := st.chat_input("Type your message here...", disabled=st.session_state.active_turn is not None):
+        if submit_turn("text", render_times, prompt=prompt):
+            rerun_chat()
 
-    # Add assistant message to history
-    st.session_state.messages.append({"role": "assistant", "content": ai_response})
-    st.rerun()
+chat_region()
@@ -0,0 +1,181 @@
+"""In-memory handling of recorded audio before speech recognition.
+
+``audio_recorder`` hands us a complete WAV file as bytes. These helpers parse
+it in memory instead of round-tripping through a temp file, downmix it to
+mono, resample it to the rate the recognizer wants and peak-normalize it with
+NumPy, so we upload and FLAC-encode a fraction of the original samples. A
+per-session noise-floor estimate calibrates the recognizer's energy threshold
+without spending the start of every utterance on it, and a frame-based voice
+activity detector trims leading and trailing silence before anything is sent.
+"""
+import io
+import wave
+
+import numpy as np
+
+# Google's speech API is tuned for 16 kHz speech; anything above that only
+# makes the upload and the FLAC encode bigger
+STT_SAMPLE_RATE = 16000
+
+# Normalized speech peaks at 90% of full scale, and quiet recordings are
+# boosted by at most 20 dB so silence doesn't turn into loud hiss
+TARGET_PEAK = 0.9
+MAX_GAIN = 10.0
+
+_LOWPASS_TAPS = 63
+
+# Speech quieter than this (about -40 dBFS) is treated as background noise even
+# when the dynamic threshold has been calibrated lower, so an empty recording
+# isn't mistaken for a whisper
+MIN_SPEECH_ENERGY = 300
+
+_INT16_SCALE = 32767.0
+
+
+def decode_wav(audio_bytes):
+    """Parse WAV bytes into ``(samples, sample_rate)``.
+
+    ``samples`` is a float32 array of shape ``(frames, channels)`` in [-1, 1].
+    """
+    with wave.open(io.BytesIO(audio_bytes), "rb") as wav:
+        channels = wav.getnchannels()
+        sample_width = wav.getsampwidth()
+        sample_rate = wav.getframerate()
+        frames = wav.readframes(wav.getnframes())
+
+    if sample_width == 1:
+        # 8-bit WAV is unsigned
+        samples = (np.frombuffer(frames, dtype=np.uint8).astype(np.float32) - 128) / 128
+    elif sample_width == 2:
+        samples = np.frombuffer(frames, dtype="<i2").astype(np.float32) / 32768
+    elif sample_width == 3:
+        raw = np.frombuffer(frames, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        ints = raw[:, 0] | raw[:, 1] << 8 | raw[:, 2] << 16
+        ints = np.where(ints & 0x800000, ints - 0x1000000, ints)
+        samples = ints.astype(np.float32) / 8388608
+    elif sample_width == 4:
+        samples = np.frombuffer(frames, dtype="<i4").astype(np.float32) / 2147483648
+    else:
+        raise ValueError(f"Unsupported sample width: {sample_width} bytes")
+
+    return samples.reshape(-1, channels), sample_rate
+
+
+def _lowpass_kernel(cutoff):
+    """Hann-windowed sinc low-pass filter; ``cutoff`` is a fraction of the input rate."""
+    n = np.arange(_LOWPASS_TAPS) - (_LOWPASS_TAPS - 1) / 2
+    kernel = 2 * cutoff * np.sinc(2 * cutoff * n) * np.hanning(_LOWPASS_TAPS)
+    return (kernel / kernel.sum()).astype(np.float32)
+
+
+def to_mono(samples, sample_rate, target_rate=STT_SAMPLE_RATE):
+    """Downmix to mono and resample to ``target_rate``."""
+    mono = samples.mean(axis=1) if samples.ndim == 2 else samples
+    if sample_rate == target_rate or not len(mono):
+        return mono
+
+    if target_rate < sample_rate:
+        # Filter out everything above the new Nyquist frequency before
+        # decimating, or it folds back into the speech band
+        mono = np.convolve(mono, _lowpass_kernel(0.45 * target_rate / sample_rate), mode="same")
+
+    out_frames = int(len(mono) * target_rate / sample_rate)
+    positions = np.arange(out_frames) * (sample_rate / target_rate)
+    return np.interp(positions, np.arange(len(mono)), mono).astype(np.float32)
+
+
+def normalize(mono):
+    """Scale so the loudest sample reaches ``TARGET_PEAK`` and convert to int16 PCM."""
+    peak = float(np.max(np.abs(mono))) if len(mono) else 0.0
+    gain = min(TARGET_PEAK / peak, MAX_GAIN) if peak > 0 else 1.0
+    return np.clip(mono * (gain * _INT16_SCALE), -_INT16_SCALE, _INT16_SCALE).astype("<i2")
+
+
+class NoiseFloor:
+    """Running estimate of one session's background noise level.
+
+    Each recording contributes the energy of its quietest frames, so the
+    estimate is refined from pauses in normal speech and no audio has to be
+    set aside for calibration. Levels are RMS on the 16-bit sample scale used
+    by ``Recognizer.energy_threshold``.
+    """
+
+    def __init__(self, frame_ms=30, quiet_fraction=0.1, smoothing=0.3):
+        self.frame_ms = frame_ms
+        self.quiet_fraction = quiet_fraction
+        self.smoothing = smoothing
+        self.level = None
+
+    def update(self, mono, sample_rate):
+        """Fold the noise level of a new mono recording into the estimate."""
+        energies = frame_rms(mono, sample_rate, self.frame_ms)
+        if not len(energies):
+            return self.level
+
+        quiet_count = max(int(len(energies) * self.quiet_fraction), 1)
+        level = float(np.partition(energies, quiet_count - 1)[:quiet_count].mean())
+        if self.level is None:
+            self.level = level
+        else:
+            self.level += (level - self.level) * self.smoothing
+        return self.level
+
+    def calibrate(self, recognizer):
+        """Set a dynamic recognizer's energy threshold from the estimate.
+
+        Mirrors ``Recognizer.adjust_for_ambient_noise``: the threshold is the
+        noise level scaled by ``dynamic_energy_ratio``.
+        """
+        if self.level is not None and recognizer.dynamic_energy_threshold:
+            recognizer.energy_threshold = max(self.level * recognizer.dynamic_energy_ratio, 1)
+
+
+def frame_rms(mono, sample_rate, frame_ms):
+    """RMS of each full ``frame_ms`` frame, on the 16-bit sample scale."""
+    frame_len = max(int(sample_rate * frame_ms / 1000), 1)
+    count = len(mono) // frame_len
+    frames = mono[:count * frame_len].reshape(count, frame_len)
+    return np.sqrt(np.mean(np.square(frames, dtype=np.float64), axis=1)) * _INT16_SCALE
+
+
+def zero_crossing_rate(mono, sample_rate, frame_ms):
+    """Fraction of sign changes within each full ``frame_ms`` frame."""
+    frame_len = max(int(sample_rate * frame_ms / 1000), 1)
+    count = len(mono) // frame_len
+    signs = np.signbit(mono[:count * frame_len].reshape(count, frame_len))
+    return np.mean(signs[:, 1:] != signs[:, :-1], axis=1) if frame_len > 1 else np.zeros(count)
+
+
+def detect_speech(mono, sample_rate, energy_threshold, dynamic=True, frame_ms=30,
+                  min_speech_ms=90, pre_roll_ms=150, hangover_ms=300):
+    """Find the span of ``mono`` that contains speech.
+
+    A frame counts as speech when its RMS energy is above ``energy_threshold``
+    (the recognizer's threshold), or above half of it with the high
+    zero-crossing rate of unvoiced sounds like "s" and "f". Speech has to last
+    ``min_speech_ms`` in a row to count, which ignores clicks and pops. The
+    span is padded by ``pre_roll_ms`` before the first speech frame and kept
+    open for ``hangover_ms`` after the last one so soft word endings survive.
+
+    Returns ``(start, end)`` sample indices, or None when there is no speech.
+    """
+    if dynamic:
+        energy_threshold = max(energy_threshold, MIN_SPEECH_ENERGY)
+    energies = frame_rms(mono, sample_rate, frame_ms)
+    zcr = zero_crossing_rate(mono, sample_rate, frame_ms)
+    active = (energies > energy_threshold) | ((energies > energy_threshold / 2) & (zcr > 0.3))
+
+    min_run = max(int(np.ceil(min_speech_ms / frame_ms)), 1)
+    if len(active) < min_run:
+        return None
+    # Indices where a run of ``min_run`` consecutive active frames starts
+    run_starts = np.flatnonzero(np.convolve(active, np.ones(min_run, dtype=int), mode="valid") == min_run)
+    if not len(run_starts):
+        return None
+
+    frame_len = max(int(sample_rate * frame_ms / 1000), 1)
+    first_frame = int(run_starts[0])
+    last_frame = int(run_starts[-1]) + min_run
+    start = max(first_frame * frame_len - int(sample_rate * pre_roll_ms / 1000), 0)
+    end = min(last_frame * frame_len + int(sample_rate * hangover_ms / 1000), len(mono))
+    return start, end
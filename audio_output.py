@@ -0,0 +1,149 @@
+"""Audio clips for playback: formats, durations, joining and compact encoding.
+
+Synthesized speech is carried around as an ``AudioClip`` (bytes plus MIME
+type), since gTTS returns MP3 and local engines return WAV. Message audio is
+re-sent to the browser on every rerun, so it can optionally be re-encoded
+as Ogg/Opus at a low bitrate with ffmpeg (``TTS_FORMAT``, ``TTS_BITRATE``).
+"""
+import io
+import os
+import shutil
+import struct
+import subprocess
+import wave
+from collections import namedtuple
+
+MP3 = "audio/mpeg"
+WAV = "audio/wav"
+OGG = "audio/ogg"
+
+AudioClip = namedtuple("AudioClip", ["data", "mime"])
+
+
+# MPEG audio Layer III lookup tables, indexed by the frame header fields
+_MP3_BITRATES = {
+    1: (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    2: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+_MP3_SAMPLE_RATES = {
+    3: (44100, 48000, 32000),  # MPEG-1
+    2: (22050, 24000, 16000),  # MPEG-2
+    0: (11025, 12000, 8000),   # MPEG-2.5
+}
+# gTTS produces 32 kbit/s MP3, used when the stream can't be parsed
+_FALLBACK_BYTES_PER_SECOND = 32000 / 8
+
+
+def mp3_duration(data):
+    """Return the playback length of MP3 bytes in seconds."""
+    pos = 0
+    if data[:3] == b"ID3" and len(data) >= 10:
+        size = data[6] << 21 | data[7] << 14 | data[8] << 7 | data[9]
+        pos = 10 + size
+
+    seconds = 0.0
+    frames = 0
+    while pos + 4 <= len(data):
+        header, = struct.unpack(">I", data[pos:pos + 4])
+        version = (header >> 19) & 0x3
+        layer = (header >> 17) & 0x3
+        bitrate_index = (header >> 12) & 0xF
+        rate_index = (header >> 10) & 0x3
+        is_frame = (
+            header >> 21 == 0x7FF and version != 1 and layer == 1
+            and 0 < bitrate_index < 15 and rate_index != 3
+        )
+        if not is_frame:
+            # Skip junk between frames (e.g. a tag in a concatenated stream)
+            pos += 1
+            continue
+
+        sample_rate = _MP3_SAMPLE_RATES[version][rate_index]
+        bitrate = _MP3_BITRATES[1 if version == 3 else 2][bitrate_index] * 1000
+        samples = 1152 if version == 3 else 576
+        padding = (header >> 9) & 0x1
+        pos += samples // 8 * bitrate // sample_rate + padding
+        seconds += samples / sample_rate
+        frames += 1
+
+    if not frames:
+        return len(data) / _FALLBACK_BYTES_PER_SECOND
+    return seconds
+
+
+def wav_duration(data):
+    """Return the playback length of WAV bytes in seconds.
+
+    Measured from the sample data actually present: a WAV written to a pipe
+    (e.g. ``espeak-ng --stdout``) keeps a placeholder length in its header.
+    """
+    try:
+        with wave.open(io.BytesIO(data), "rb") as wav:
+            frame_size = wav.getsampwidth() * wav.getnchannels()
+            payload = wav.readframes(wav.getnframes())
+            return len(payload) / frame_size / wav.getframerate()
+    except (wave.Error, EOFError):
+        return 0.0
+
+
+def ogg_opus_duration(data):
+    """Return the playback length of an Ogg/Opus stream in seconds.
+
+    The granule position of the last page counts 48 kHz samples.
+    """
+    pos = data.rfind(b"OggS")
+    if pos < 0 or pos + 14 > len(data):
+        return 0.0
+    granule, = struct.unpack("<q", data[pos + 6:pos + 14])
+    return max(granule, 0) / 48000
+
+
+def clip_duration(clip):
+    if clip.mime == WAV:
+        return wav_duration(clip.data)
+    if clip.mime == OGG:
+        return ogg_opus_duration(clip.data)
+    return mp3_duration(clip.data)
+
+
+def join_clips(clips):
+    """Join same-format clips into one playable clip."""
+    if len(clips) == 1:
+        return clips[0]
+    mime = clips[0].mime
+    if mime == MP3:
+        # MP3 frames can simply be concatenated
+        return AudioClip(b"".join(clip.data for clip in clips), mime)
+    if mime == WAV:
+        buffer = io.BytesIO()
+        with wave.open(buffer, "wb") as out:
+            for i, clip in enumerate(clips):
+                with wave.open(io.BytesIO(clip.data), "rb") as wav:
+                    if i == 0:
+                        out.setparams(wav.getparams())
+                    out.writeframes(wav.readframes(wav.getnframes()))
+        return AudioClip(buffer.getvalue(), mime)
+    raise ValueError(f"Can't join {mime} clips")
+
+
+def encode_ogg(clip, bitrate="24k"):
+    """Re-encode ``clip`` as Ogg/Opus; returns it unchanged without ffmpeg."""
+    ffmpeg = shutil.which("ffmpeg")
+    if ffmpeg is None or clip.mime == OGG:
+        return clip
+    result = subprocess.run(
+        [ffmpeg, "-hide_banner", "-loglevel", "error", "-i", "pipe:0",
+         "-c:a", "libopus", "-b:a", bitrate, "-application", "voip", "-f", "ogg", "pipe:1"],
+        input=clip.data, capture_output=True
+    )
+    if result.returncode != 0 or not result.stdout:
+        return clip
+    return AudioClip(result.stdout, OGG)
+
+
+def compact_audio(clips):
+    """Join a message's clips and encode them in the configured storage format."""
+    clip = join_clips(clips)
+    if os.getenv("TTS_FORMAT", "native") == "ogg":
+        clip = encode_ogg(clip, os.getenv("TTS_BITRATE", "24k"))
+    return clip
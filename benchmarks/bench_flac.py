@@ -0,0 +1,138 @@
+"""FLAC encoding benchmark: soundfile (in-process) against the ``flac`` subprocess.
+
+Encodes speech-like utterances the way ``speech_to_text.recognize_google``
+uploads them (16-bit mono) with each available encoder, one at a time and
+from concurrent threads, and reports latency, throughput and compressed size.
+``--verify`` also decodes every encoder's output with the ``flac`` binary and
+checks that it matches the input. Results are written as JSON.
+
+Usage (from the repository root):
+
+    python -m benchmarks.bench_flac --output flac.json
+    python -m benchmarks.bench_flac --seconds 2 --repeats 10 --verify   # quick run
+"""
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+import speech_recognition as sr
+
+from benchmarks.bench_turns import git_commit, summarize
+from flac_encoder import _soundfile_available, encode_soundfile
+
+
+def synthetic_utterance(seconds, sample_rate):
+    """Mono 16-bit PCM with a voiced, amplitude-modulated tone over noise."""
+    rng = np.random.default_rng(0)
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    envelope = 0.5 + 0.5 * np.sin(2 * np.pi * 3 * t) ** 2
+    audio = 0.25 * envelope * np.sin(2 * np.pi * 180 * t) + rng.normal(0, 0.003, len(t))
+    return (np.clip(audio, -1, 1) * 32767).astype("<i2").tobytes()
+
+
+def encoders():
+    available = {
+        "subprocess": lambda audio: audio.get_flac_data(convert_width=2),
+    }
+    if _soundfile_available():
+        available["soundfile"] = lambda audio: encode_soundfile(audio.frame_data, audio.sample_rate)
+    return available
+
+
+def decode(flac):
+    """Raw little-endian PCM decoded by the ``flac`` binary."""
+    return subprocess.run(
+        [sr.audio.get_flac_converter(), "--decode", "--stdout", "--silent",
+         "--force-raw-format", "--endian=little", "--sign=signed", "-"],
+        input=flac, capture_output=True, check=True
+    ).stdout
+
+
+def run_sequential(encode, audio, repeats):
+    encode(audio)  # warm up
+    samples = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        encode(audio)
+        samples.append({"encode_ms": (time.perf_counter() - started) * 1000})
+    return summarize(samples)
+
+
+def run_concurrent(encode, audio, threads, repeats):
+    """Encode from ``threads`` threads at once and report utterances per second."""
+    errors = []
+
+    def worker():
+        try:
+            for _ in range(repeats):
+                encode(audio)
+        except Exception as e:
+            errors.append(repr(e))
+
+    started = time.perf_counter()
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    return {
+        "threads": threads,
+        "elapsed_s": round(elapsed, 3),
+        "utterances_per_second": round((threads * repeats - len(errors)) / elapsed, 1),
+        "errors": errors,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--seconds", type=float, nargs="+", default=[2.0, 5.0, 15.0],
+                        help="utterance lengths to encode")
+    parser.add_argument("--sample-rate", type=int, default=16000)
+    parser.add_argument("--repeats", type=int, default=30, help="encodes per measurement")
+    parser.add_argument("--threads", type=int, default=8, help="concurrent encoders for the throughput run")
+    parser.add_argument("--verify", action="store_true", help="check every encoding decodes losslessly")
+    parser.add_argument("--output", help="write JSON here instead of stdout")
+    args = parser.parse_args(argv)
+
+    results = {
+        "benchmark": "flac_encoding",
+        "timestamp": time.time(),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "args": vars(args),
+        "scenarios": [],
+    }
+    for seconds in args.seconds:
+        pcm = synthetic_utterance(seconds, args.sample_rate)
+        audio = sr.AudioData(pcm, args.sample_rate, 2)
+        for name, encode in encoders().items():
+            flac = encode(audio)
+            scenario = {
+                "encoder": name,
+                "seconds": seconds,
+                "pcm_bytes": len(pcm),
+                "flac_bytes": len(flac),
+                "ratio": round(len(flac) / len(pcm), 3),
+                "latency": run_sequential(encode, audio, args.repeats),
+                "throughput": run_concurrent(encode, audio, args.threads, args.repeats),
+            }
+            if args.verify:
+                scenario["lossless"] = decode(flac) == pcm
+            results["scenarios"].append(scenario)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,344 @@
+"""End-to-end turn latency benchmark, fully offline.
+
+Runs voice and text turns through ``engine.VoiceEngine``, the same code the app's
+workers execute (audio preprocessing and VAD, context window, chat session
+reuse, sentence streaming TTS and the TTS cache), against the local fakes in
+``benchmarks.fakes``, across response lengths and history sizes. Results are
+written as JSON so runs can be compared between releases.
+
+Every scenario gets a fresh rate-limit scheduler, unlimited by default so
+turn latency is not dominated by the production limits; ``--rate-limits env``
+applies ``GEMINI_RATE_LIMIT`` and friends instead. Time spent waiting for the
+limiter is reported separately as ``rate_wait_ms``.
+
+Usage (from the repository root):
+
+    python -m benchmarks.bench_turns --output bench.json
+    python -m benchmarks.bench_turns --latency-scale 0.1 --turns 3   # quick run
+"""
+import argparse
+import io
+import json
+import platform
+import subprocess
+import sys
+import threading
+import time
+import wave
+
+import numpy as np
+
+from benchmarks import fakes
+from engine import EngineConfig, VoiceEngine
+from http_pool import get_http_pool
+from rate_limit import DEFAULT_LIMITS, RateLimitScheduler, get_scheduler, limits_from_env, set_scheduler
+from resilience import backend_stats, get_backend
+from speech_pipeline import SentenceSplitter
+from speech_to_text import get_stt_router
+from tracing import TurnTrace
+from tts_cache import get_tts_cache
+from turns import LENGTH_PRESETS, TurnJob
+
+LENGTHS = ("Short", "Medium", "Long")
+HISTORY_TURNS = (0, 10, 40)
+PROMPT = "Can you help me understand how photosynthesis works?"
+# Requests per second and burst high enough that the limiter never waits
+UNLIMITED = (1e9, 10 ** 9)
+
+
+def synthetic_recording(speech_seconds=2.0, lead_silence=0.5, tail_silence=1.5, sample_rate=44100):
+    """A stereo 16-bit WAV with speech-like audio framed by silence."""
+    rng = np.random.default_rng(0)
+    total = int((lead_silence + speech_seconds + tail_silence) * sample_rate)
+    audio = rng.normal(0, 0.003, total)
+    start = int(lead_silence * sample_rate)
+    t = np.arange(int(speech_seconds * sample_rate)) / sample_rate
+    envelope = 0.5 + 0.5 * np.sin(2 * np.pi * 3 * t) ** 2
+    audio[start:start + len(t)] += 0.25 * envelope * np.sin(2 * np.pi * 180 * t)
+    pcm = (np.clip(audio, -1, 1) * 32767).astype("<i2")
+
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(2)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(np.repeat(pcm, 2).tobytes())
+    return buffer.getvalue()
+
+
+def filler_history(turns):
+    messages = []
+    for i in range(turns):
+        messages.append({"role": "user", "content": f"Question {i}: " + " ".join(fakes.SENTENCES[:2])})
+        messages.append({"role": "assistant", "content": " ".join(fakes.SENTENCES[:5])})
+    return messages
+
+
+class BenchSession:
+    """One conversation, as the app keeps it in ``st.session_state.engine``."""
+
+    def __init__(self, length, history_turns):
+        self.engine = VoiceEngine(EngineConfig(response_length=length))
+        self.engine.messages = filler_history(history_turns)
+        # Turns without a reply, and replies that came with a notice (e.g. no
+        # audio after TTS 429s)
+        self.failed = 0
+        self.degraded = 0
+        self.notices = set()
+
+    def turn(self, prompt=None, audio_bytes=None):
+        """Run one turn through the engine and return its timings in milliseconds.
+
+        Returns None for a turn that produced no reply; it is counted in
+        ``failed`` instead of being timed.
+        """
+        trace = TurnTrace("voice" if audio_bytes is not None else "text")
+        job = TurnJob(trace.kind, prompt=prompt, audio_bytes=audio_bytes, trace=trace)
+        snapshot = self.engine.run(job)
+        finished = time.perf_counter()
+
+        if "Error: " in snapshot["reply"]:
+            # Generation errors end up in the reply text
+            raise RuntimeError(f"Turn failed: {snapshot['reply']}")
+        self.notices.update(message for _, message in snapshot["notices"])
+        if not snapshot["reply"]:
+            self.failed += 1
+            return None
+        if snapshot["notices"]:
+            self.degraded += 1
+
+        spans = {}
+        for span in trace.to_dict()["spans"]:
+            spans[span["name"]] = span["duration_ms"]
+            if span["name"].endswith(".rate_wait"):
+                spans["rate_wait"] = spans.get("rate_wait", 0.0) + span["duration_ms"]
+        timings = {
+            # Response cache hits make no Gemini call at all
+            "llm_first_chunk_ms": spans.get("llm.first_chunk", 0.0),
+            "llm_total_ms": spans.get("llm.generate", 0.0),
+            "time_to_first_audio_ms": ((job.first_segment_at or finished) - trace.started) * 1000,
+            "turn_ms": (finished - trace.started) * 1000,
+            # Summed over every Gemini, STT and TTS call, some of which overlap
+            "rate_wait_ms": spans.get("rate_wait", 0.0),
+        }
+        if audio_bytes is not None:
+            timings["stt_ms"] = spans["stt.transcribe"]
+        return timings
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = max(int(round(pct / 100 * len(ordered))) - 1, 0)
+    return ordered[index]
+
+
+def summarize(samples):
+    summary = {}
+    if not samples:
+        return summary
+    for name in samples[0]:
+        values = [sample[name] for sample in samples]
+        summary[name] = {
+            "mean": round(sum(values) / len(values), 1),
+            "p50": round(percentile(values, 50), 1),
+            "p95": round(percentile(values, 95), 1),
+            "max": round(max(values), 1),
+        }
+    return summary
+
+
+def turn_outcomes(sessions):
+    """Failed and degraded turns across ``sessions``, with the notices they showed."""
+    return {
+        "failed_turns": sum(session.failed for session in sessions),
+        "degraded_turns": sum(session.degraded for session in sessions),
+        "notices": sorted(set().union(*(session.notices for session in sessions))),
+    }
+
+
+def run_scenario(mode, length, history_turns, turns, recording, warm_cache):
+    cache = get_tts_cache()
+    cache.clear()
+    cache.reset_stats()
+    session = BenchSession(length, history_turns)
+    samples = []
+    for _ in range(turns):
+        if not warm_cache:
+            cache.clear()
+        if mode == "voice":
+            samples.append(session.turn(audio_bytes=recording))
+        else:
+            samples.append(session.turn(prompt=PROMPT))
+    return {
+        "mode": mode,
+        "response_length": length,
+        "history_turns": history_turns,
+        "turns": turns,
+        **turn_outcomes([session]),
+        "latency": summarize([sample for sample in samples if sample is not None]),
+        "tts_cache": cache.stats(),
+    }
+
+
+def count_sentences(text):
+    """Sentences in ``text`` as the reply's TTS splits them."""
+    splitter = SentenceSplitter()
+    return len(splitter.feed(text) + splitter.flush())
+
+
+def run_overlong(config, length, turns):
+    """Text turns whose replies run past the preset's sentence budget.
+
+    Each reply is cut off mid-stream, and the next turn must still reuse the
+    live chat with the truncated reply in its history.
+    """
+    config.overlong_replies = True
+    try:
+        session = BenchSession(length, 0)
+        samples = [session.turn(prompt=f"{PROMPT} ({turn})") for turn in range(turns)]
+    finally:
+        config.overlong_replies = False
+    max_sentences = LENGTH_PRESETS[length]["max_sentences"]
+    replies = [message["content"] for message in session.engine.messages if message["role"] == "assistant"]
+    return {
+        "mode": "overlong",
+        "response_length": length,
+        "turns": turns,
+        "max_sentences": max_sentences,
+        "within_budget": all(count_sentences(reply) <= max_sentences for reply in replies),
+        "chat_rebuilds": session.engine.chat_manager.rebuilds,
+        **turn_outcomes([session]),
+        "latency": summarize([sample for sample in samples if sample is not None]),
+    }
+
+
+def run_throughput(sessions, turns, length, recording):
+    """Run ``sessions`` concurrent sessions and report completed turns per second."""
+    get_tts_cache().clear()
+    errors = []
+    completed = []
+    bench_sessions = [BenchSession(length, 0) for _ in range(sessions)]
+
+    def worker(index):
+        session = bench_sessions[index]
+        try:
+            for turn in range(turns):
+                if index % 2:
+                    timings = session.turn(audio_bytes=recording)
+                else:
+                    timings = session.turn(prompt=f"{PROMPT} ({index}-{turn})")
+                if timings is not None:
+                    completed.append(timings)
+        except Exception as e:
+            errors.append(repr(e))
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(sessions)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    return {
+        "sessions": sessions,
+        "turns_per_session": turns,
+        "response_length": length,
+        "elapsed_s": round(elapsed, 3),
+        "turns_per_second": round(len(completed) / elapsed, 3),
+        **turn_outcomes(bench_sessions),
+        "errors": errors,
+    }
+
+
+def with_scheduler(limits, run, *args):
+    """Run a scenario on a fresh scheduler and add its rate limiter stats."""
+    set_scheduler(RateLimitScheduler(limits))
+    result = run(*args)
+    result["rate_limits"] = get_scheduler().stats()
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--turns", type=int, default=5, help="turns per scenario")
+    parser.add_argument("--history", type=int, nargs="+", default=list(HISTORY_TURNS),
+                        help="prior conversation turns to start each scenario with")
+    parser.add_argument("--lengths", nargs="+", default=list(LENGTHS), choices=LENGTHS)
+    parser.add_argument("--modes", nargs="+", default=["voice", "text"], choices=["voice", "text"])
+    parser.add_argument("--sessions", type=int, default=8, help="concurrent sessions for the throughput run")
+    parser.add_argument("--latency-scale", type=float, default=1.0,
+                        help="multiply every fake latency by this factor (e.g. 0.1 for a quick run)")
+    parser.add_argument("--tts-429-rate", type=float, default=0.0,
+                        help="fraction of TTS requests that fail with 429")
+    parser.add_argument("--tts-tail-rate", type=float, default=0.0,
+                        help="fraction of TTS requests that are 10x slower than usual")
+    parser.add_argument("--rate-limits", choices=["unlimited", "env"], default="unlimited",
+                        help="rate limits per scenario: none, or the *_RATE_LIMIT settings")
+    parser.add_argument("--hedge", action="store_true", help="hedge slow TTS and STT requests")
+    parser.add_argument("--warm-cache", action="store_true", help="keep TTS audio cached between turns")
+    parser.add_argument("--output", help="write JSON here instead of stdout")
+    args = parser.parse_args(argv)
+
+    config = fakes.FakeConfig(tts_429_rate=args.tts_429_rate, tts_tail_rate=args.tts_tail_rate)
+    for name, value in vars(config).items():
+        if not name.startswith("_") and isinstance(value, float) and not name.startswith("tts_tail") \
+                and name != "tts_429_rate":
+            setattr(config, name, value * args.latency_scale)
+
+    for backend in ("tts", "stt"):
+        get_backend(backend).hedge = args.hedge
+
+    if args.rate_limits == "env":
+        limits = limits_from_env()
+    else:
+        limits = {name: UNLIMITED for name in DEFAULT_LIMITS}
+
+    recording = synthetic_recording()
+    results = {
+        "benchmark": "voice_turns",
+        "timestamp": time.time(),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "args": vars(args),
+        "fake_config": {k: v for k, v in vars(config).items() if not k.startswith("_") and k != "calls"},
+        "rate_limit_config": limits,
+        "scenarios": [],
+    }
+    with fakes.install(config):
+        for mode in args.modes:
+            for length in args.lengths:
+                for history_turns in args.history:
+                    results["scenarios"].append(with_scheduler(
+                        limits, run_scenario, mode, length, history_turns, args.turns, recording, args.warm_cache
+                    ))
+        results["overlong"] = [
+            with_scheduler(limits, run_overlong, config, length, args.turns) for length in args.lengths
+        ]
+        results["throughput"] = with_scheduler(
+            limits, run_throughput, args.sessions, args.turns, "Medium", recording
+        )
+    results["upstream_calls"] = config.calls
+    results["backends"] = backend_stats()
+    results["http_pool"] = get_http_pool().stats()
+    results["stt_engines"] = get_stt_router().stats()
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,252 @@
+"""Local stand-ins for Gemini, Google Speech Recognition and gTTS.
+
+Each fake sleeps for a configurable, deterministic amount of time instead of
+calling the network, so benchmark runs are repeatable offline. ``install``
+swaps them into the modules the app uses.
+"""
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+import google.generativeai as genai
+import gtts
+
+import speech_to_text
+import text_to_speech
+from context_window import estimate_tokens
+from flac_encoder import flac_data
+from turns import LENGTH_PRESETS
+
+SENTENCES = [
+    "That's a great question, so let's break it down together.",
+    "The short version is that it depends on what you're trying to do.",
+    "Most people find it easiest to start small and build from there.",
+    "Here's a quick example that should make it click.",
+    "Try it out and see how it feels before changing anything else.",
+    "If you get stuck, just tell me which part is confusing.",
+    "We can always dig deeper into any of these points later.",
+    "Honestly, you're already on the right track.",
+]
+
+# Sentences the fake model writes for each response-length preset
+REPLY_SENTENCES = {"Short": 2, "Medium": 4, "Long": 7}
+
+
+class FakeConfig:
+    """Latency and failure settings shared by all fakes, in seconds."""
+
+    def __init__(self, llm_first_chunk=0.35, llm_chunk_interval=0.04, llm_per_1k_tokens=0.03,
+                 words_per_chunk=6, stt_base=0.25, stt_per_audio_second=0.04,
+                 tts_base=0.12, tts_per_100_chars=0.08, tts_429_rate=0.0, tts_tail_rate=0.0,
+                 tts_tail_factor=10.0, overlong_replies=False, seed=0):
+        self.llm_first_chunk = llm_first_chunk
+        self.llm_chunk_interval = llm_chunk_interval
+        # Extra time to first chunk per 1k tokens of prompt and history
+        self.llm_per_1k_tokens = llm_per_1k_tokens
+        self.words_per_chunk = words_per_chunk
+        self.stt_base = stt_base
+        self.stt_per_audio_second = stt_per_audio_second
+        self.tts_base = tts_base
+        # gTTS sends one request per ~100 characters
+        self.tts_per_100_chars = tts_per_100_chars
+        self.tts_429_rate = tts_429_rate
+        # Fraction of TTS requests that are ``tts_tail_factor`` times slower
+        self.tts_tail_rate = tts_tail_rate
+        self.tts_tail_factor = tts_tail_factor
+        # Replies longer than the preset allows, so they are cut off mid-stream
+        self.overlong_replies = overlong_replies
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = {"llm": 0, "stt": 0, "tts": 0, "tts_429": 0, "tts_slow": 0}
+
+    def count(self, name):
+        with self._lock:
+            self.calls[name] += 1
+
+    def roll(self, rate):
+        with self._lock:
+            return self._random.random() < rate
+
+
+class FakeChunk:
+    def __init__(self, text):
+        self.text = text
+        self.parts = [text] if text else []
+
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeIncompleteIterationError(Exception):
+    pass
+
+
+class FakeChat:
+    """Stands in for ``genai.ChatSession``.
+
+    Like the SDK, it only appends an exchange once its stream has been read
+    to the end, and reading ``history`` or calling ``rewind`` before then
+    raises; assigning ``history`` drops the unfinished exchange.
+    """
+
+    def __init__(self, model, history):
+        self.model = model
+        self._history = list(history)
+        self._streaming = False
+
+    def _check_complete(self):
+        if self._streaming:
+            raise FakeIncompleteIterationError(
+                "Please let the response complete iteration before accessing the final accumulated attributes"
+            )
+
+    @property
+    def history(self):
+        self._check_complete()
+        return self._history
+
+    @history.setter
+    def history(self, history):
+        self._history = list(history)
+        self._streaming = False
+
+    def rewind(self):
+        self._check_complete()
+        return self._history.pop(-2), self._history.pop()
+
+    def send_message(self, content, stream=False, **kwargs):
+        config = self.model.config
+        config.count("llm")
+        context = self.model.system_instruction + content + "".join(
+            part for message in self._history for part in message["parts"]
+        )
+        sentences = self.model.reply_sentences()
+        reply = " ".join(SENTENCES[i % len(SENTENCES)] for i in range(sentences))
+        words = reply.split(" ")
+        chunks = [
+            " ".join(words[i:i + config.words_per_chunk]) + " "
+            for i in range(0, len(words), config.words_per_chunk)
+        ]
+
+        def generate():
+            time.sleep(config.llm_first_chunk + config.llm_per_1k_tokens * estimate_tokens(context) / 1000)
+            for i, chunk in enumerate(chunks):
+                if i:
+                    time.sleep(config.llm_chunk_interval)
+                yield FakeChunk(chunk)
+            self._history.append({"role": "user", "parts": [content]})
+            self._history.append({"role": "model", "parts": [reply]})
+            self._streaming = False
+
+        self._streaming = True
+        return generate() if stream else FakeResponse("".join(c.text for c in generate()))
+
+
+class FakeGenerativeModel:
+    """Stands in for ``genai.GenerativeModel``; streams canned sentences."""
+
+    config = FakeConfig()
+
+    def __init__(self, model_name, system_instruction=None, **kwargs):
+        self.model_name = model_name
+        self.system_instruction = system_instruction or ""
+
+    def reply_sentences(self):
+        length = next(
+            (length for length in REPLY_SENTENCES if LENGTH_PRESETS[length]["instruction"] in self.system_instruction),
+            "Medium"
+        )
+        if self.config.overlong_replies:
+            # Ignore the guideline and run past the preset's sentence budget
+            return LENGTH_PRESETS[length]["max_sentences"] + 3
+        return REPLY_SENTENCES[length]
+
+    def start_chat(self, history=None):
+        return FakeChat(self, history or [])
+
+    def generate_content(self, prompt, **kwargs):
+        self.config.count("llm")
+        time.sleep(self.config.llm_first_chunk)
+        return FakeResponse("The user and assistant have been chatting about studying.")
+
+
+def fake_recognize_google(recognizer, audio_data, language="en-US", key=None):
+    """Stands in for ``speech_to_text.recognize_google``; cost grows with upload size.
+
+    The upload is still encoded to FLAC, as the real request does.
+    """
+    config = FakeGenerativeModel.config
+    config.count("stt")
+    flac_data(audio_data)
+    seconds = len(audio_data.frame_data) / (audio_data.sample_rate * audio_data.sample_width)
+    time.sleep(config.stt_base + config.stt_per_audio_second * seconds)
+    return "can you help me understand how photosynthesis works"
+
+
+class FakeTTSError(Exception):
+    pass
+
+
+def _fake_tts_request(text):
+    config = FakeGenerativeModel.config
+    config.count("tts")
+    if config.roll(config.tts_429_rate):
+        config.count("tts_429")
+        time.sleep(config.tts_base)
+        raise FakeTTSError("429 (Too Many Requests) from TTS API. Probable cause: Unknown")
+    latency = config.tts_base + config.tts_per_100_chars * len(text) / 100
+    if config.roll(config.tts_tail_rate):
+        config.count("tts_slow")
+        latency *= config.tts_tail_factor
+    time.sleep(latency)
+    # ~1 second of 24 kHz, 32 kbit/s MPEG-2 audio per 15 characters
+    return fake_mp3(max(len(text) / 15, 0.2))
+
+
+class FakeGTTS:
+    """Stands in for ``gTTS``; one simulated request per 100 characters."""
+
+    timeout = None
+
+    def __init__(self, text, lang="en", slow=False, tld="com", **kwargs):
+        self.text = text
+
+    def _prepare_requests(self):
+        # The fake "requests" are just the text pieces gTTS would send
+        return [self.text[i:i + 100] for i in range(0, len(self.text), 100)]
+
+    def write_to_fp(self, fp):
+        for piece in self._prepare_requests():
+            fp.write(_fake_tts_request(piece))
+
+
+def fake_fetch_chunk(tts, request):
+    """Stands in for ``text_to_speech.fetch_chunk``."""
+    return _fake_tts_request(request)
+
+
+def fake_mp3(seconds):
+    """Silent-looking MP3 frames that ``mp3_duration`` can measure."""
+    header = ((0x7FF << 21) | (2 << 19) | (1 << 17) | (1 << 16) | (4 << 12) | (1 << 10)).to_bytes(4, "big")
+    frame = header + bytes(92)  # 72 * 32000 / 24000 bytes per frame
+    return frame * max(int(seconds * 24000 / 576), 1)
+
+
+@contextmanager
+def install(config):
+    """Swap the fakes into genai, gTTS, SpeechRecognition and the TTS module."""
+    saved = (genai.GenerativeModel, speech_to_text.recognize_google, gtts.gTTS,
+             text_to_speech.fetch_chunk)
+    FakeGenerativeModel.config = config
+    genai.GenerativeModel = FakeGenerativeModel
+    speech_to_text.recognize_google = fake_recognize_google
+    gtts.gTTS = FakeGTTS
+    text_to_speech.fetch_chunk = fake_fetch_chunk
+    try:
+        yield config
+    finally:
+        (genai.GenerativeModel, speech_to_text.recognize_google, gtts.gTTS,
+         text_to_speech.fetch_chunk) = saved
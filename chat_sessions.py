@@ -0,0 +1,131 @@
+"""Session-scoped Gemini chat sessions.
+
+Rebuilding the model and replaying the whole conversation on every turn costs
+O(history) work per message. The manager keeps one live ``ChatSession`` per
+browser session and only rebuilds it when the personality or response length
+changes, or when the conversation no longer matches what the chat has seen.
+
+The Gemini SDK takes about a second to import, so it is only loaded when the
+first model is built rather than when the page or engine starts.
+"""
+import threading
+
+_genai = None
+_genai_lock = threading.Lock()
+_api_key = None
+
+
+def load_genai():
+    """Import and configure ``google.generativeai`` on first use."""
+    global _genai
+    with _genai_lock:
+        if _genai is None:
+            import google.generativeai as genai
+
+            if _api_key:
+                genai.configure(api_key=_api_key)
+            _genai = genai
+        return _genai
+
+
+def configure_gemini(api_key):
+    """Set the Gemini API key without importing the SDK yet."""
+    global _api_key
+    with _genai_lock:
+        _api_key = api_key
+        if _genai is not None and api_key:
+            _genai.configure(api_key=api_key)
+
+
+def gemini_model(model_name, **kwargs):
+    """Build a ``GenerativeModel``, loading the SDK if this is the first one."""
+    return load_genai().GenerativeModel(model_name, **kwargs)
+
+
+def to_gemini_history(messages):
+    """Convert app messages into the history format Gemini expects."""
+    return [
+        {
+            "role": "user" if msg["role"] == "user" else "model",
+            "parts": [msg["content"]]
+        }
+        for msg in messages
+    ]
+
+
+class ChatSessionManager:
+    """Keep a live ChatSession keyed by (personality, response length)."""
+
+    def __init__(self, model_name="gemini-2.5-flash", model_factory=None):
+        self.model_name = model_name
+        self.model_factory = model_factory or gemini_model
+        self.key = None
+        self.chat = None
+        # Number of app messages already reflected in the chat history
+        self.synced = 0
+        self.rebuilds = 0
+        # Conversation generation, bumped by ``reset``; calls that pass an
+        # older one come from a turn that outlived its conversation
+        self.generation = 0
+
+    def _stale(self, generation):
+        return generation is not None and generation != self.generation
+
+    def get_chat(self, key, system_instruction, messages, generation=None):
+        """Return a chat whose history matches ``messages``.
+
+        ``messages`` is the conversation before the current prompt. The live
+        chat is reused as long as the key matches and every earlier turn went
+        through it; otherwise it is rebuilt from ``messages``. A turn from an
+        older ``generation`` gets a chat of its own, so it can't add its
+        exchange to the new conversation's chat.
+        """
+        if self._stale(generation):
+            return self._build(system_instruction, messages)
+        if self.chat is None or key != self.key or len(messages) != self.synced:
+            self.chat = self._build(system_instruction, messages)
+            self.key = key
+            self.synced = len(messages)
+            self.rebuilds += 1
+        return self.chat
+
+    def _build(self, system_instruction, messages):
+        model = self.model_factory(
+            self.model_name,
+            system_instruction=system_instruction
+        )
+        return model.start_chat(history=to_gemini_history(messages))
+
+    def commit_turn(self, generation=None):
+        """Record that the prompt and its reply are now in the chat history."""
+        if not self._stale(generation):
+            self.synced += 2
+
+    def commit_truncated_turn(self, messages, prompt, reply, generation=None):
+        """Record a turn whose stream we stopped reading early.
+
+        The chat only appends an exchange once its stream has been read to
+        the end, and its ``history`` getter and ``rewind`` raise until then.
+        So the history is set outright: ``messages`` (what ``get_chat`` was
+        given), the prompt and the part of the reply the user actually got.
+        """
+        if self._stale(generation):
+            return
+        self.chat.history = to_gemini_history(list(messages) + [
+            {"role": "user", "content": prompt},
+            {"role": "assistant", "content": reply}
+        ])
+        self.synced += 2
+
+    def invalidate(self, generation=None):
+        """Drop the live chat, e.g. after an error; ignored for an older ``generation``."""
+        if self._stale(generation):
+            return
+        self.chat = None
+        self.key = None
+        self.synced = 0
+
+    def reset(self, generation):
+        """Start conversation ``generation``, e.g. when history is cleared."""
+        self.generation = generation
+        self.invalidate()
@@ -0,0 +1,128 @@
+"""Token-budgeted conversation context with a rolling summary.
+
+Only the most recent turns are sent to Gemini verbatim. Once they exceed the
+token budget, the oldest turns are folded into a running summary that is
+passed along with the system instruction instead. The window slides in large
+steps so the summary is only regenerated occasionally, not on every turn.
+"""
+from chat_sessions import gemini_model
+from rate_limit import INTERACTIVE, get_scheduler
+
+# Rough average for English text; good enough for budgeting without a
+# round-trip to the count_tokens endpoint
+CHARS_PER_TOKEN = 4
+
+SUMMARY_PROMPT = """Update the running summary of a conversation between a user and an AI assistant.
+Keep names, facts, decisions, open questions and anything the user asked to remember.
+Write at most {max_words} words of plain prose.
+
+Current summary:
+{summary}
+
+New turns to fold in:
+{turns}
+
+Updated summary:"""
+
+
+def estimate_tokens(text):
+    """Estimate the token count of ``text`` locally."""
+    return max(1, (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN)
+
+
+def format_turns(messages):
+    return "\n".join(
+        f"{'User' if msg['role'] == 'user' else 'Assistant'}: {msg['content']}"
+        for msg in messages
+    )
+
+
+def extractive_summary(summary, messages, max_chars=1200):
+    """Fallback summary built from the first sentence of each turn."""
+    lines = [summary] if summary else []
+    for msg in messages:
+        first_sentence = msg["content"].strip().split(". ")[0][:200]
+        speaker = "User" if msg["role"] == "user" else "Assistant"
+        lines.append(f"{speaker}: {first_sentence}")
+    return "\n".join(lines)[-max_chars:]
+
+
+class GeminiSummarizer:
+    """Fold turns into the running summary with a plain Gemini call."""
+
+    def __init__(self, model_name="gemini-2.5-flash", max_words=150, model_factory=None):
+        self.model_name = model_name
+        self.max_words = max_words
+        self.model_factory = model_factory or gemini_model
+        self._model = None
+
+    def __call__(self, summary, messages):
+        if self._model is None:
+            self._model = self.model_factory(self.model_name)
+        prompt = SUMMARY_PROMPT.format(
+            max_words=self.max_words,
+            summary=summary or "(none yet)",
+            turns=format_turns(messages)
+        )
+        # The summary is made inside a turn, before its prompt is sent, so it
+        # can't wait behind other sessions' turns
+        response = get_scheduler().call("gemini", lambda: self._model.generate_content(prompt), INTERACTIVE)
+        return response.text.strip()
+
+
+class ConversationContext:
+    """Keep recent turns verbatim and older turns as a rolling summary."""
+
+    def __init__(self, budget_tokens=3000, keep_ratio=0.6, summarize=None):
+        self.budget_tokens = budget_tokens
+        # After sliding, the verbatim window is cut down to this share of the
+        # budget so the next slide is several turns away
+        self.keep_ratio = keep_ratio
+        self.summarize = summarize or GeminiSummarizer()
+        self.reset()
+
+    def reset(self):
+        self.summary = ""
+        self.folded = 0  # Leading messages already folded into the summary
+        self.version = 0  # Bumped every time the summary changes
+
+    def window(self, messages):
+        """Return the verbatim messages to send for the conversation ``messages``."""
+        if len(messages) < self.folded:
+            # The conversation was cleared or replaced under us
+            self.reset()
+
+        recent = messages[self.folded:]
+        used = estimate_tokens(self.summary) if self.summary else 0
+        used += sum(estimate_tokens(msg["content"]) for msg in recent)
+        if used > self.budget_tokens:
+            self._slide(recent)
+        return messages[self.folded:]
+
+    def _slide(self, recent):
+        target = self.budget_tokens * self.keep_ratio
+        kept = estimate_tokens(self.summary) if self.summary else 0
+        kept += sum(estimate_tokens(msg["content"]) for msg in recent)
+        fold = 0
+        # Fold whole user/assistant pairs so the window still starts with a user turn
+        while fold + 2 <= len(recent) and kept > target:
+            kept -= estimate_tokens(recent[fold]["content"])
+            kept -= estimate_tokens(recent[fold + 1]["content"])
+            fold += 2
+        if not fold:
+            return
+
+        to_fold = recent[:fold]
+        try:
+            self.summary = self.summarize(self.summary, to_fold)
+        except Exception:
+            # Never fail a turn because the summary call failed
+            self.summary = extractive_summary(self.summary, to_fold)
+        self.folded += fold
+        self.version += 1
+
+    def system_instruction(self, base_instruction):
+        """Append the running summary, if any, to the system instruction."""
+        if not self.summary:
+            return base_instruction
+        return f"{base_instruction}\n\nSummary of the earlier conversation:\n{self.summary}"
@@ -0,0 +1,224 @@
+"""Durable conversations in SQLite.
+
+Set ``CONVERSATION_DB`` to a database path to keep conversations across
+server restarts and share them between server processes: any process can
+pick a session up by its id, so a load balancer doesn't need sticky
+sessions. The database runs in WAL mode, so readers never wait for the
+writer, and each turn is written in a single transaction.
+
+Messages are read lazily through ``StoredConversation``: rendering loads only
+the visible window, and the Gemini context only the turns after the rolling
+summary, which is stored with the session. Only the latest reply's audio is
+kept, since it is the only one that is ever replayed.
+"""
+import os
+import sqlite3
+import threading
+import time
+from collections.abc import Sequence
+
+from audio_output import AudioClip
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    personality TEXT NOT NULL,
+    response_length TEXT NOT NULL,
+    summary TEXT NOT NULL DEFAULT '',
+    folded INTEGER NOT NULL DEFAULT 0,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS messages (
+    session_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    created REAL NOT NULL,
+    PRIMARY KEY (session_id, position)
+);
+CREATE TABLE IF NOT EXISTS reply_audio (
+    session_id TEXT PRIMARY KEY,
+    position INTEGER NOT NULL,
+    mime TEXT NOT NULL,
+    data BLOB NOT NULL
+);
+"""
+
+# Messages read per query when iterating over a whole conversation
+PAGE_SIZE = 256
+
+
+class ConversationStore:
+    """Sessions, messages and the latest reply audio in one SQLite database."""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        connection = self._connection()
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.executescript(SCHEMA)
+
+    def _connection(self):
+        # One connection per thread: turns are recorded from script threads
+        # while other sessions read theirs
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            # Durable at every checkpoint; WAL keeps the database consistent regardless
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def load_session(self, session_id):
+        row = self._connection().execute(
+            "SELECT personality, response_length, summary, folded FROM sessions WHERE session_id = ?",
+            (session_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        return {"personality": row[0], "response_length": row[1], "summary": row[2], "folded": row[3]}
+
+    def save_settings(self, session_id, personality, response_length):
+        self._connection().execute(
+            "INSERT INTO sessions (session_id, personality, response_length, updated) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (session_id) DO UPDATE SET personality = excluded.personality, "
+            "response_length = excluded.response_length, updated = excluded.updated",
+            (session_id, personality, response_length, time.time())
+        )
+
+    def count(self, session_id):
+        row = self._connection().execute(
+            "SELECT COALESCE(MAX(position) + 1, 0) FROM messages WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        return row[0]
+
+    def load(self, session_id, start, end):
+        """Messages ``start:end`` of a conversation, in order."""
+        rows = self._connection().execute(
+            "SELECT role, content FROM messages WHERE session_id = ? AND position >= ? AND position < ? "
+            "ORDER BY position",
+            (session_id, start, end)
+        ).fetchall()
+        return [{"role": role, "content": content} for role, content in rows]
+
+    def append_turn(self, session_id, messages, summary, folded, audio=None):
+        """Write a finished turn, the context summary and its audio in one transaction.
+
+        The turn goes after whatever the session holds by then, which may
+        include turns written by another tab or process; returns the
+        position of its first message.
+        """
+        now = time.time()
+        connection = self._connection()
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            position = connection.execute(
+                "SELECT COALESCE(MAX(position) + 1, 0) FROM messages WHERE session_id = ?", (session_id,)
+            ).fetchone()[0]
+            connection.executemany(
+                "INSERT INTO messages (session_id, position, role, content, created) VALUES (?, ?, ?, ?, ?)",
+                [
+                    (session_id, position + offset, message["role"], message["content"], now)
+                    for offset, message in enumerate(messages)
+                ]
+            )
+            connection.execute(
+                "UPDATE sessions SET summary = ?, folded = ?, updated = ? WHERE session_id = ?",
+                (summary, folded, now, session_id)
+            )
+            if audio is not None:
+                self._put_audio(connection, session_id, position + len(messages) - 1, audio)
+        return position
+
+    def _put_audio(self, connection, session_id, position, clip):
+        connection.execute(
+            "INSERT OR REPLACE INTO reply_audio (session_id, position, mime, data) VALUES (?, ?, ?, ?)",
+            (session_id, position, clip.mime, clip.data)
+        )
+
+    def put_audio(self, session_id, position, clip):
+        """Keep ``clip`` as the session's latest reply audio."""
+        self._put_audio(self._connection(), session_id, position, clip)
+
+    def get_audio(self, session_id, position):
+        row = self._connection().execute(
+            "SELECT mime, data FROM reply_audio WHERE session_id = ? AND position = ?", (session_id, position)
+        ).fetchone()
+        return AudioClip(bytes(row[1]), row[0]) if row else None
+
+    def clear(self, session_id):
+        """Delete a session's messages, audio and summary, keeping its settings."""
+        connection = self._connection()
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            connection.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+            connection.execute("DELETE FROM reply_audio WHERE session_id = ?", (session_id,))
+            connection.execute(
+                "UPDATE sessions SET summary = '', folded = 0, updated = ? WHERE session_id = ?",
+                (time.time(), session_id)
+            )
+
+    def stats(self):
+        connection = self._connection()
+        page_count = connection.execute("PRAGMA page_count").fetchone()[0]
+        page_size = connection.execute("PRAGMA page_size").fetchone()[0]
+        return {
+            "sessions": connection.execute("SELECT COUNT(*) FROM sessions").fetchone()[0],
+            "messages": connection.execute("SELECT COUNT(*) FROM messages").fetchone()[0],
+            "bytes": page_count * page_size,
+        }
+
+
+class StoredConversation(Sequence):
+    """A conversation's messages as a read-only sequence, loaded on access.
+
+    Slicing runs one query for the whole slice. ``view`` returns a copy fixed
+    at the current length, for turns that must not see later messages.
+    """
+
+    def __init__(self, store, session_id, length=None):
+        self.store = store
+        self.session_id = session_id
+        self._length = store.count(session_id) if length is None else length
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self._length)
+            if step != 1:
+                return self.store.load(self.session_id, 0, self._length)[index]
+            return self.store.load(self.session_id, start, stop) if start < stop else []
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError("message index out of range")
+        return self.store.load(self.session_id, index, index + 1)[0]
+
+    def __iter__(self):
+        for start in range(0, self._length, PAGE_SIZE):
+            yield from self.store.load(self.session_id, start, min(start + PAGE_SIZE, self._length))
+
+    def view(self):
+        return StoredConversation(self.store, self.session_id, self._length)
+
+    def extend_to(self, length):
+        """Account for messages written since the view was created, e.g. by ``append_turn``."""
+        self._length = max(self._length, length)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_conversation_store():
+    """Return the shared store, or None unless ``CONVERSATION_DB`` is set."""
+    global _store
+    path = os.getenv("CONVERSATION_DB")
+    if not path:
+        return None
+    with _store_lock:
+        if _store is None:
+            _store = ConversationStore(path)
+        return _store
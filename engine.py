@@ -0,0 +1,236 @@
+"""The voice assistant's conversation engine, usable without Streamlit.
+
+A ``VoiceEngine`` holds one conversation: its messages, personality, response
+length, live Gemini chat, context window and noise-floor estimate. Turns run
+through ``turns.run_turn`` exactly as they do behind the Streamlit page, so
+tests, benchmarks and batch jobs exercise the same code:
+
+    engine = VoiceEngine(EngineConfig.from_env())
+    reply = engine.ask("What can you do?")
+
+With a ``ConversationStore`` the conversation is kept in SQLite under its
+session id instead of in memory, and picked up again by any process that
+creates an engine with the same id.
+
+Nothing here reads the environment on import or loads a speech or LLM SDK;
+those are imported by the first turn that needs them.
+"""
+import os
+import threading
+import uuid
+
+from chat_sessions import ChatSessionManager, configure_gemini
+from context_window import ConversationContext
+from conversation_store import StoredConversation
+from personalities import PERSONALITIES
+from turns import DONE, LENGTH_PRESETS, TurnJob, run_turn
+
+
+class EngineConfig:
+    """Settings for a ``VoiceEngine``; ``from_env`` reads the app's ``.env`` settings."""
+
+    def __init__(self, api_key=None, model_name="gemini-2.5-flash", context_token_budget=3000,
+                 personality="General Assistant", response_length="Medium", session_id=None):
+        if personality not in PERSONALITIES:
+            raise ValueError(f"Unknown personality: {personality}")
+        if response_length not in LENGTH_PRESETS:
+            raise ValueError(f"Unknown response length: {response_length}")
+        self.api_key = api_key
+        self.model_name = model_name
+        self.context_token_budget = context_token_budget
+        self.personality = personality
+        self.response_length = response_length
+        # Identifies the conversation in a ConversationStore; a new one if None
+        self.session_id = session_id
+
+    @classmethod
+    def from_env(cls, **overrides):
+        """Config from ``GEMINI_API_KEY`` and ``CONTEXT_TOKEN_BUDGET``, plus ``overrides``."""
+        settings = {
+            "api_key": os.getenv("GEMINI_API_KEY"),
+            "context_token_budget": int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000")),
+        }
+        settings.update(overrides)
+        return cls(**settings)
+
+
+class VoiceEngine:
+    """One conversation and the per-conversation state its turns need."""
+
+    def __init__(self, config=None, chat_manager=None, context=None, store=None):
+        self.config = config or EngineConfig()
+        if self.config.api_key:
+            configure_gemini(self.config.api_key)
+        self.session_id = self.config.session_id or uuid.uuid4().hex
+        self.personality = self.config.personality
+        self.response_length = self.config.response_length
+        self.messages = []
+        self.chat_manager = chat_manager or ChatSessionManager(model_name=self.config.model_name)
+        self.context = context or ConversationContext(budget_tokens=self.config.context_token_budget)
+        self.vad_stats = {"trimmed_ms": 0, "rejected": 0}
+        # Bumped by every reset; turns from an older generation are discarded
+        self.generation = 0
+        self._noise_floor = None
+        self._lock = threading.Lock()
+        self.store = store
+        if store is not None:
+            self._restore()
+
+    def _restore(self):
+        """Pick up the stored conversation for this session id, if there is one."""
+        saved = self.store.load_session(self.session_id)
+        if saved is None:
+            self.store.save_settings(self.session_id, self.personality, self.response_length)
+        else:
+            if saved["personality"] in PERSONALITIES:
+                self.personality = saved["personality"]
+            if saved["response_length"] in LENGTH_PRESETS:
+                self.response_length = saved["response_length"]
+            self.context.summary = saved["summary"]
+            self.context.folded = saved["folded"]
+        self.messages = StoredConversation(self.store, self.session_id)
+
+    @property
+    def noise_floor(self):
+        """Noise-floor estimate for voice turns, created (with NumPy) on first use."""
+        with self._lock:
+            if self._noise_floor is None:
+                from audio_input import NoiseFloor
+
+                self._noise_floor = NoiseFloor()
+            return self._noise_floor
+
+    def set_personality(self, personality):
+        """Switch personality; the conversation starts over."""
+        if personality not in PERSONALITIES:
+            raise ValueError(f"Unknown personality: {personality}")
+        self.personality = personality
+        self._save_settings()
+        self.reset()
+
+    def set_response_length(self, response_length):
+        if response_length not in LENGTH_PRESETS:
+            raise ValueError(f"Unknown response length: {response_length}")
+        self.response_length = response_length
+        self._save_settings()
+
+    def _save_settings(self):
+        if self.store is not None:
+            self.store.save_settings(self.session_id, self.personality, self.response_length)
+
+    def reset(self):
+        """Forget the conversation, its live chat and its summary.
+
+        Turns still queued or running finish, but are not added to the new
+        conversation or its chat.
+        """
+        self.generation += 1
+        if self.store is None:
+            self.messages = []
+        else:
+            self.store.clear(self.session_id)
+            self.messages = StoredConversation(self.store, self.session_id, 0)
+        self.chat_manager.reset(self.generation)
+        self.context.reset()
+
+    def resident_messages(self):
+        """The messages held in memory; stored conversations are read on demand."""
+        return self.messages if self.store is None else []
+
+    def turn_runner(self):
+        """A ``fn(job)`` that runs a turn against the conversation as it is now.
+
+        The history, personality, length and generation are captured here, so
+        settings changed while the turn runs on a worker only apply to the
+        next one, and a turn that outlives a reset can't touch the new
+        conversation.
+        """
+        generation = self.generation
+        history = list(self.messages) if self.store is None else self.messages.view()
+        personality = self.personality
+        response_length = self.response_length
+
+        def run(job):
+            if generation != self.generation:
+                # Reset while the turn was queued; nothing is left to answer
+                return
+            run_turn(
+                job,
+                history=history,
+                personality=personality,
+                personality_prompt=PERSONALITIES[personality]["prompt"],
+                response_length=response_length,
+                chat_manager=self.chat_manager,
+                context=self.context,
+                noise_floor=self.noise_floor if job.kind == "voice" else None,
+                vad_stats=self.vad_stats,
+                generation=generation
+            )
+
+        return run
+
+    def submit(self, job, pool):
+        """Run ``job`` on a ``TurnWorkerPool``; returns False if its backlog is full."""
+        job.generation = self.generation
+        return pool.submit(job, self.turn_runner())
+
+    def run(self, job):
+        """Run ``job`` on this thread and add the finished turn to the conversation."""
+        job.generation = self.generation
+        try:
+            self.turn_runner()(job)
+        finally:
+            job.set_state(DONE)
+        snapshot = job.snapshot()
+        self.record(snapshot)
+        return snapshot
+
+    def record(self, snapshot):
+        """Add a finished turn to the conversation.
+
+        Returns the index of the assistant message, or None if the turn
+        produced no reply (nothing was heard, or it failed) or belongs to a
+        conversation that has since been reset.
+        """
+        if snapshot["generation"] not in (None, self.generation):
+            return None
+        if not snapshot["transcript"]:
+            return None
+        turn = [{"role": "user", "content": snapshot["transcript"]}]
+        if snapshot["reply"]:
+            turn.append({"role": "assistant", "content": snapshot["reply"]})
+
+        if self.store is None:
+            self.messages.extend(turn)
+            position = len(self.messages) - len(turn)
+        else:
+            # The turn, the context summary and the reply audio in one write
+            position = self.store.append_turn(
+                self.session_id, turn,
+                summary=self.context.summary,
+                folded=self.context.folded,
+                audio=snapshot.get("audio") if snapshot["reply"] else None
+            )
+            # Other tabs on the same session may have added turns meanwhile
+            self.messages.extend_to(position + len(turn))
+        return position + len(turn) - 1 if snapshot["reply"] else None
+
+    def reply_audio(self, index):
+        """Stored audio for the reply at ``index``, if the store has it."""
+        return self.store.get_audio(self.session_id, index) if self.store is not None else None
+
+    def save_reply_audio(self, index, clip):
+        if self.store is not None:
+            self.store.put_audio(self.session_id, index, clip)
+
+    def ask(self, prompt, trace=None):
+        """Run a text turn synchronously and return the reply text.
+
+        Problems (e.g. TTS errors) are left on the snapshot's notices; use
+        ``run`` to see them.
+        """
+        return self.run(TurnJob("text", prompt=prompt, trace=trace))["reply"]
+
+    def listen(self, audio_bytes, trace=None):
+        """Run a voice turn on a WAV recording synchronously; returns its snapshot."""
+        return self.run(TurnJob("voice", audio_bytes=audio_bytes, trace=trace))
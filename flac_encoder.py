@@ -0,0 +1,56 @@
+"""In-process FLAC encoding for speech recognition uploads.
+
+SpeechRecognition encodes each utterance by piping it through the bundled
+``flac`` binary, so every transcription pays for a process spawn and two
+pipe copies. With the ``soundfile`` package (libsndfile) installed, uploads
+are encoded in-process instead.
+
+``FLAC_ENCODER`` picks the encoder: ``auto`` (default: soundfile if it can
+be loaded, else the ``flac`` binary), ``soundfile`` or ``subprocess``.
+Forcing ``soundfile`` without the package is reported as an
+``sr.RequestError``, so the STT router treats it as an engine failure.
+"""
+import io
+import os
+
+import numpy as np
+
+ENCODERS = ("auto", "soundfile", "subprocess")
+
+
+def encode_soundfile(pcm, sample_rate):
+    import soundfile
+
+    buffer = io.BytesIO()
+    soundfile.write(buffer, np.frombuffer(pcm, dtype="<i2"), sample_rate, format="FLAC", subtype="PCM_16")
+    return buffer.getvalue()
+
+
+_soundfile = None
+
+
+def _soundfile_available():
+    global _soundfile
+    if _soundfile is None:
+        try:
+            import soundfile  # noqa: F401
+            _soundfile = True
+        except (ImportError, OSError):
+            # OSError: the package is installed but libsndfile isn't
+            _soundfile = False
+    return _soundfile
+
+
+def flac_data(audio_data, convert_rate=None):
+    """``AudioData.get_flac_data`` for 16-bit uploads, encoded as ``FLAC_ENCODER`` says."""
+    import speech_recognition as sr
+
+    encoder = os.getenv("FLAC_ENCODER", "auto")
+    if encoder not in ENCODERS:
+        raise ValueError(f"Unknown FLAC encoder: {encoder}")
+    if encoder == "soundfile" and not _soundfile_available():
+        raise sr.RequestError("FLAC_ENCODER=soundfile, but soundfile or libsndfile is not installed")
+    if encoder != "subprocess" and _soundfile_available():
+        pcm = audio_data.get_raw_data(convert_rate=convert_rate, convert_width=2)
+        return encode_soundfile(pcm, convert_rate or audio_data.sample_rate)
+    return audio_data.get_flac_data(convert_rate=convert_rate, convert_width=2)
@@ -0,0 +1,71 @@
+"""One pooled, keep-alive HTTP session for the speech APIs.
+
+gTTS and SpeechRecognition would otherwise open a new connection (TCP and
+TLS handshake) for every request. Everything here shares a single
+``requests.Session`` whose connection pools are reused across turns and
+sessions. Gemini is not included: its client keeps its own gRPC channel.
+"""
+import os
+import threading
+
+
+class PooledSession:
+    """A ``requests.Session`` with sized connection pools and reuse counters."""
+
+    def __init__(self, pool_size=16, keep_alive=True):
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        class Adapter(HTTPAdapter):
+            def add_headers(self, request, **kwargs):
+                # Called for every request the adapter sends, including
+                # prepared ones that never see the session's headers
+                if not keep_alive:
+                    request.headers["Connection"] = "close"
+
+        self.pool_size = pool_size
+        self.keep_alive = keep_alive
+        self.session = requests.Session()
+        self._adapter = Adapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", self._adapter)
+        self.session.mount("http://", self._adapter)
+
+    def send(self, request, **kwargs):
+        """Send a prepared request through the shared pools."""
+        return self.session.send(request, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.session.post(url, **kwargs)
+
+    def stats(self):
+        """Connections opened vs. requests sent, summed over the live host pools."""
+        pools = self._adapter.poolmanager.pools
+        host_pools = [pool for pool in map(pools.get, pools.keys()) if pool is not None]
+        # Counters some urllib3 versions may not have count as zero
+        connections = sum(getattr(pool, "num_connections", 0) for pool in host_pools)
+        requests_sent = sum(getattr(pool, "num_requests", 0) for pool in host_pools)
+        return {
+            "hosts": len(host_pools),
+            "connections": connections,
+            "requests": requests_sent,
+            "reused": max(requests_sent - connections, 0),
+        }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_http_pool():
+    """Return the process-wide pool, sized by ``HTTP_POOL_SIZE``.
+
+    Set ``HTTP_KEEPALIVE=0`` to close connections after each request.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = PooledSession(
+                pool_size=int(os.getenv("HTTP_POOL_SIZE", "16")),
+                keep_alive=os.getenv("HTTP_KEEPALIVE", "1") != "0"
+            )
+        return _pool
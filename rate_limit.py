@@ -0,0 +1,219 @@
+"""Process-wide rate limiting for the upstream APIs.
+
+Every session shares one scheduler with a token bucket per backend (Gemini,
+speech recognition, gTTS). Callers wait their turn in a priority queue, so
+work for a turn a user is waiting on goes ahead of background work. When a
+backend still answers 429, the call is retried with jittered exponential
+backoff (or the server's Retry-After), and the whole backend is paused for
+that long so other sessions back off too.
+"""
+import email.utils
+import heapq
+import itertools
+import os
+import random
+import threading
+import time
+
+from tracing import maybe_span
+
+# Priorities; lower runs first
+INTERACTIVE = 0
+BACKGROUND = 1
+
+# Default (requests per second, burst) for each backend; override with e.g.
+# TTS_RATE_LIMIT=4:8
+DEFAULT_LIMITS = {
+    "gemini": (2.0, 5),
+    "stt": (5.0, 10),
+    "tts": (8.0, 16),
+}
+
+
+class TokenBucket:
+    """Classic token bucket, plus a pause used to back off after a 429."""
+
+    def __init__(self, rate, capacity, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.tokens = float(capacity)
+        self.updated = clock()
+        self.paused_until = 0.0
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self):
+        """Seconds until a token can be taken (0 if one is available now)."""
+        now = self.clock()
+        self._refill(now)
+        wait = 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+        return max(wait, self.paused_until - now)
+
+    def take(self):
+        self.tokens -= 1
+
+    def pause(self, seconds):
+        self.paused_until = max(self.paused_until, self.clock() + seconds)
+
+
+class _Backend:
+    def __init__(self, bucket):
+        self.bucket = bucket
+        self.cond = threading.Condition()
+        self.waiting = []  # heap of (priority, sequence) tickets
+        self.calls = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.max_depth = 0
+        self.throttled = 0
+        self.retries = 0
+
+
+def is_rate_limited(error):
+    """True if ``error`` looks like an HTTP 429 / quota error from any client."""
+    for attr in ("code", "status_code"):
+        if getattr(error, attr, None) == 429:
+            return True
+    message = str(error).lower()
+    return "429" in message or "too many requests" in message or "resource exhausted" in message
+
+
+def retry_after(error):
+    """Seconds from a Retry-After header on the error's HTTP response, if any."""
+    response = getattr(error, "rsp", None) or getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    value = headers.get("Retry-After") if headers else None
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        try:
+            moment = email.utils.parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        return max(moment.timestamp() - time.time(), 0.0)
+
+
+class RateLimitScheduler:
+    """Per-backend token buckets with a priority queue and 429 backoff."""
+
+    def __init__(self, limits=None, max_retries=3, base_delay=1.0, max_delay=16.0):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._sequence = itertools.count()
+        self._backends = {
+            name: _Backend(TokenBucket(rate, burst))
+            for name, (rate, burst) in (limits or DEFAULT_LIMITS).items()
+        }
+
+    def acquire(self, backend, priority=INTERACTIVE):
+        """Block until ``backend`` may be called; returns the seconds waited."""
+        state = self._backends[backend]
+        started = time.monotonic()
+        with state.cond:
+            ticket = (priority, next(self._sequence))
+            heapq.heappush(state.waiting, ticket)
+            state.max_depth = max(state.max_depth, len(state.waiting))
+            while True:
+                if state.waiting[0] == ticket:
+                    delay = state.bucket.delay()
+                    if delay <= 0:
+                        state.bucket.take()
+                        heapq.heappop(state.waiting)
+                        break
+                    state.cond.wait(delay)
+                else:
+                    state.cond.wait()
+            # Let the next ticket in line check the bucket
+            state.cond.notify_all()
+
+            waited = time.monotonic() - started
+            state.calls += 1
+            state.total_wait += waited
+            state.max_wait = max(state.max_wait, waited)
+        return waited
+
+    def backoff(self, attempt, error=None):
+        """Delay before retry ``attempt`` (0-based): Retry-After or jittered exponential."""
+        server_delay = retry_after(error) if error is not None else None
+        if server_delay is not None:
+            return min(server_delay, self.max_delay)
+        delay = min(self.max_delay, self.base_delay * 2 ** attempt)
+        return delay * random.uniform(0.5, 1.0)
+
+    def call(self, backend, fn, priority=INTERACTIVE, trace=None):
+        """Call ``fn()`` within ``backend``'s rate limit, retrying on 429s."""
+        state = self._backends[backend]
+        for attempt in range(self.max_retries + 1):
+            with maybe_span(trace, f"{backend}.rate_wait"):
+                self.acquire(backend, priority)
+            try:
+                return fn()
+            except Exception as e:
+                if not is_rate_limited(e) or attempt == self.max_retries:
+                    raise
+                delay = self.backoff(attempt, e)
+                with state.cond:
+                    state.throttled += 1
+                    state.retries += 1
+                    # Everyone calling this backend backs off, not just us
+                    state.bucket.pause(delay)
+                with maybe_span(trace, f"{backend}.retry_sleep", attempt=attempt + 1):
+                    time.sleep(delay)
+
+    def stats(self):
+        stats = {}
+        for name, state in self._backends.items():
+            with state.cond:
+                stats[name] = {
+                    "queue_depth": len(state.waiting),
+                    "max_queue_depth": state.max_depth,
+                    "calls": state.calls,
+                    "avg_wait_ms": round(state.total_wait / state.calls * 1000, 1) if state.calls else 0.0,
+                    "max_wait_ms": round(state.max_wait * 1000, 1),
+                    "throttled": state.throttled,
+                    "retries": state.retries,
+                }
+        return stats
+
+
+def limits_from_env():
+    """``DEFAULT_LIMITS`` with any ``<BACKEND>_RATE_LIMIT`` overrides applied."""
+    limits = {}
+    for name, (rate, burst) in DEFAULT_LIMITS.items():
+        value = os.getenv(f"{name.upper()}_RATE_LIMIT")
+        if value:
+            rate_text, _, burst_text = value.partition(":")
+            rate = float(rate_text)
+            burst = int(burst_text) if burst_text else max(int(rate), 1)
+        limits[name] = (rate, burst)
+    return limits
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """Return the scheduler shared by every session in this process.
+
+    Limits come from ``GEMINI_RATE_LIMIT``, ``STT_RATE_LIMIT`` and
+    ``TTS_RATE_LIMIT`` as ``requests_per_second[:burst]``.
+    """
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = RateLimitScheduler(limits_from_env())
+        return _scheduler
+
+
+def set_scheduler(scheduler):
+    """Replace the process-wide scheduler, e.g. with one a benchmark configured."""
+    global _scheduler
+    with _scheduler_lock:
+        _scheduler = scheduler
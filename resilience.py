@@ -0,0 +1,215 @@
+"""Tail-latency protection for the speech backends.
+
+Each backend (gTTS, speech recognition) gets a circuit breaker and a rolling
+latency window. While a backend keeps failing, the breaker opens and calls
+fail fast, so a turn falls back to text instead of waiting on timeouts. With
+hedging enabled, a call that is still running after the backend's recent p95
+latency is raced against a second identical request, and whichever finishes
+first wins.
+"""
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from tracing import maybe_span
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+# Losing hedged requests can't be cancelled, so they finish here unobserved
+_HEDGE_EXECUTOR = ThreadPoolExecutor(max_workers=8, thread_name_prefix="hedge")
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a backend whose breaker is open."""
+
+
+class LatencyTracker:
+    """Recent call latencies for one backend, in seconds."""
+
+    def __init__(self, window=200):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._samples)
+
+    def percentile(self, pct):
+        with self._lock:
+            ordered = sorted(self._samples)
+        if not ordered:
+            return None
+        return ordered[max(int(round(pct / 100 * len(ordered))) - 1, 0)]
+
+
+class CircuitBreaker:
+    """Open after ``failure_threshold`` consecutive failures; probe again after ``reset_timeout``."""
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self.rejected = 0
+        self.trips = 0
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == OPEN and self.clock() - self._opened_at >= self.reset_timeout:
+                return HALF_OPEN
+            return self._state
+
+    def allow(self):
+        """Whether a call may go through now; half-open lets a single probe in."""
+        with self._lock:
+            if self._state == OPEN and self.clock() - self._opened_at >= self.reset_timeout:
+                self._state = HALF_OPEN
+                self._probing = False
+            if self._state == CLOSED:
+                return True
+            if self._state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._state = CLOSED
+            self._failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != OPEN:
+                    self.trips += 1
+                self._state = OPEN
+                self._opened_at = self.clock()
+                self._probing = False
+
+
+def hedged_call(fn, hedge_after, executor=_HEDGE_EXECUTOR):
+    """Call ``fn()``; if it hasn't finished after ``hedge_after`` seconds, race a second call.
+
+    Returns ``(result, hedged)`` from whichever call succeeds first. If both
+    fail, the first error is raised.
+    """
+    primary = executor.submit(fn)
+    done, _ = wait([primary], timeout=hedge_after)
+    if done:
+        return primary.result(), False
+
+    pending = {primary, executor.submit(fn)}
+    errors = []
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                return future.result(), True
+            errors.append(future.exception())
+    raise errors[0]
+
+
+class Backend:
+    """Circuit breaker, latency window and optional hedging for one upstream API."""
+
+    def __init__(self, name, breaker=None, hedge=False, hedge_min_delay=0.3, min_samples=20):
+        self.name = name
+        self.breaker = breaker or CircuitBreaker()
+        self.latency = LatencyTracker()
+        self.hedge = hedge
+        self.hedge_min_delay = hedge_min_delay
+        self.min_samples = min_samples
+        self._lock = threading.Lock()
+        self.hedges = 0
+
+    def hedge_delay(self):
+        """Seconds to wait before hedging, or None until there's enough history."""
+        if not self.hedge or len(self.latency) < self.min_samples:
+            return None
+        return max(self.latency.percentile(95), self.hedge_min_delay)
+
+    def call(self, fn, trace=None, ignore=()):
+        """Call ``fn()`` through the breaker, hedging slow calls if enabled.
+
+        Exceptions in ``ignore`` (e.g. "no speech recognized") are re-raised
+        but count as a healthy response.
+        """
+        if not self.breaker.allow():
+            raise CircuitOpenError(f"{self.name} is temporarily unavailable")
+
+        started = time.perf_counter()
+        delay = self.hedge_delay()
+        try:
+            if delay is None:
+                result = fn()
+            else:
+                with maybe_span(trace, f"{self.name}.hedged_call", hedge_after_ms=round(delay * 1000)):
+                    result, hedged = hedged_call(fn, delay)
+                if hedged:
+                    with self._lock:
+                        self.hedges += 1
+        except ignore:
+            self.breaker.record_success()
+            raise
+        except Exception:
+            self.breaker.record_failure()
+            raise
+        self.breaker.record_success()
+        self.latency.record(time.perf_counter() - started)
+        return result
+
+    def stats(self):
+        p95 = self.latency.percentile(95)
+        return {
+            "state": self.breaker.state,
+            "trips": self.breaker.trips,
+            "rejected": self.breaker.rejected,
+            "hedges": self.hedges,
+            "p95_ms": round(p95 * 1000) if p95 is not None else None,
+        }
+
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def get_backend(name):
+    """Return the process-wide guard for ``name`` ("tts" or "stt").
+
+    Configured by ``HEDGE_REQUESTS`` (1 to enable), ``HEDGE_MIN_MS``,
+    ``CIRCUIT_FAILURES`` and ``CIRCUIT_RESET_SECONDS``.
+    """
+    with _backends_lock:
+        if name not in _backends:
+            _backends[name] = Backend(
+                name,
+                breaker=CircuitBreaker(
+                    failure_threshold=int(os.getenv("CIRCUIT_FAILURES", "5")),
+                    reset_timeout=float(os.getenv("CIRCUIT_RESET_SECONDS", "30"))
+                ),
+                hedge=os.getenv("HEDGE_REQUESTS", "0") == "1",
+                hedge_min_delay=int(os.getenv("HEDGE_MIN_MS", "300")) / 1000
+            )
+        return _backends[name]
+
+
+def backend_stats():
+    with _backends_lock:
+        backends = dict(_backends)
+    return {name: backend.stats() for name, backend in backends.items()}
@@ -0,0 +1,109 @@
+"""Opt-in, process-wide cache of Gemini replies for repeated prompts.
+
+A reply is reused only when the personality, response length, normalized
+prompt and the conversation so far all match, so a cached answer is never
+served into a conversation it wasn't written for. Turns only use the cache
+for the first prompt of a conversation, the case where identical questions
+actually repeat ("what can you do?"). Cached replies are spoken sentence by sentence like any other reply,
+so their audio comes straight from the TTS cache as well.
+"""
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_prompt(prompt):
+    """Fold case, whitespace and trailing punctuation: "What can you do?" == "what can you do"."""
+    return _WHITESPACE.sub(" ", prompt).strip().lower().rstrip(".!?")
+
+
+def context_hash(messages):
+    """Stable hash of the conversation before this prompt."""
+    digest = hashlib.sha256()
+    for message in messages:
+        digest.update(f"{message['role']}\0{message['content']}\0".encode("utf-8"))
+    return digest.hexdigest()
+
+
+class ResponseCache:
+    """TTL + LRU cache of reply text, bounded by entry count."""
+
+    def __init__(self, max_entries=256, ttl=3600, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(personality, response_length, prompt, history):
+        payload = "\0".join([personality, response_length, normalize_prompt(prompt), context_hash(history)])
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """Return the cached reply for ``key``, or None if missing or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.clock() - entry[1] > self.ttl:
+                del self._entries[key]
+                self.expired += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, reply):
+        with self._lock:
+            self._entries[key] = (reply, self.clock())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "expired": self.expired,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """Return the shared cache, or None unless ``RESPONSE_CACHE=1``.
+
+    Sized by ``RESPONSE_CACHE_SIZE`` entries, each kept for
+    ``RESPONSE_CACHE_TTL`` seconds.
+    """
+    global _cache
+    if os.getenv("RESPONSE_CACHE", "0") != "1":
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache(
+                max_entries=int(os.getenv("RESPONSE_CACHE_SIZE", "256")),
+                ttl=float(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+            )
+        return _cache
@@ -0,0 +1,210 @@
+"""Headless WebSocket server for kiosk and mobile clients.
+
+Each WebSocket connection is one conversation (a ``VoiceEngine``). With
+``CONVERSATION_DB`` set, connect to ``/?session=<id>`` to resume a stored
+conversation on any server process; ``ready`` reports the id. Turns run
+on the same worker pool, personalities and response-length presets as the
+Streamlit page, and their output is pushed to the client as it is produced.
+
+Client messages (JSON text frames):
+
+- ``{"type": "config", "personality": "...", "response_length": "Short"}``;
+  changing the personality starts a new conversation
+- ``{"type": "text", "text": "..."}``
+- ``{"type": "audio", "data": "<base64 WAV>"}``, or the WAV as a binary frame
+- ``{"type": "reset"}``
+
+Server messages:
+
+- ``ready`` / ``config``: the session id and the available and current
+  personality and length
+- ``transcript``: what was heard, for audio turns
+- ``text``: the next chunk of the reply
+- ``audio``: the next spoken sentence, ``{"index", "mime", "data"}`` (base64)
+- ``notice``: a warning or error about the turn, ``{"level", "message"}``
+- ``done``: the turn is over, with the full ``reply`` and ``turn_ms``
+- ``error``: the last client message was rejected
+
+One turn runs at a time per connection; messages sent meanwhile are handled
+once it is done. Engine calls that read or write the conversation store run
+in a thread, so a locked database never stalls the event loop.
+
+Usage (from the repository root):
+
+    python server.py --port 8765
+"""
+import argparse
+import asyncio
+import base64
+import binascii
+import json
+import logging
+import time
+from urllib.parse import parse_qs, urlsplit
+
+from dotenv import load_dotenv
+from websockets.asyncio.server import serve
+from websockets.exceptions import ConnectionClosed
+
+from conversation_store import get_conversation_store
+from engine import EngineConfig, VoiceEngine
+from personalities import PERSONALITIES
+from tracing import get_tracer
+from turns import DONE, LENGTH_PRESETS, TurnJob, get_worker_pool
+
+logger = logging.getLogger(__name__)
+
+
+async def send(websocket, message_type, **fields):
+    await websocket.send(json.dumps({"type": message_type, **fields}))
+
+
+async def send_config(websocket, engine, message_type="config"):
+    await send(
+        websocket, message_type,
+        session_id=engine.session_id,
+        personality=engine.personality,
+        response_length=engine.response_length,
+        personalities=list(PERSONALITIES),
+        response_lengths=list(LENGTH_PRESETS)
+    )
+
+
+async def stream_turn(websocket, engine, kind, prompt=None, audio_bytes=None):
+    """Run one turn on the worker pool and push its output as it lands."""
+    loop = asyncio.get_running_loop()
+    updated = asyncio.Event()
+    trace = get_tracer().start_turn(kind)
+    job = TurnJob(kind, prompt=prompt, audio_bytes=audio_bytes, trace=trace,
+                  on_update=lambda: loop.call_soon_threadsafe(updated.set))
+    if not engine.submit(job, get_worker_pool()):
+        await send(websocket, "error", message="The assistant is busy right now. Please try again in a moment.")
+        return
+
+    transcript_sent = kind == "text"
+    reply_sent = 0
+    segments_sent = 0
+    notices_sent = 0
+    while True:
+        await updated.wait()
+        updated.clear()
+        snapshot = job.snapshot()
+
+        if not transcript_sent and snapshot["transcript"]:
+            await send(websocket, "transcript", text=snapshot["transcript"])
+            transcript_sent = True
+        if len(snapshot["reply"]) > reply_sent:
+            await send(websocket, "text", text=snapshot["reply"][reply_sent:])
+            reply_sent = len(snapshot["reply"])
+        for clip in snapshot["segments"][segments_sent:]:
+            await send(
+                websocket, "audio",
+                index=segments_sent,
+                mime=clip.mime,
+                data=base64.b64encode(clip.data).decode("ascii")
+            )
+            segments_sent += 1
+        for level, message in snapshot["notices"][notices_sent:]:
+            await send(websocket, "notice", level=level, message=message)
+            notices_sent += 1
+
+        if snapshot["state"] == DONE:
+            break
+
+    await asyncio.to_thread(engine.record, snapshot)
+    job.trace.add("turn.complete", job.trace.started, time.perf_counter())
+    record = get_tracer().finish(job.trace)
+    await send(websocket, "done", reply=snapshot["reply"], turn_ms=round(record["total_ms"]))
+
+
+def decode_audio(message):
+    try:
+        return base64.b64decode(message.get("data", ""), validate=True)
+    except (binascii.Error, TypeError, ValueError):
+        return None
+
+
+async def handle_audio(websocket, engine, audio_bytes):
+    if not audio_bytes:
+        return "Audio messages need WAV data"
+    await stream_turn(websocket, engine, "voice", audio_bytes=audio_bytes)
+    return None
+
+
+async def handle_message(websocket, engine, message):
+    """Handle one client message; returns an error string if it was rejected."""
+    message_type = message.get("type")
+    if message_type == "config":
+        try:
+            if "personality" in message and message["personality"] != engine.personality:
+                await asyncio.to_thread(engine.set_personality, message["personality"])
+            if "response_length" in message:
+                await asyncio.to_thread(engine.set_response_length, message["response_length"])
+        except ValueError as e:
+            return str(e)
+        await send_config(websocket, engine)
+    elif message_type == "reset":
+        await asyncio.to_thread(engine.reset)
+        await send_config(websocket, engine)
+    elif message_type == "text":
+        text = str(message.get("text", "")).strip()
+        if not text:
+            return "Empty text message"
+        await stream_turn(websocket, engine, "text", prompt=text)
+    elif message_type == "audio":
+        return await handle_audio(websocket, engine, decode_audio(message))
+    else:
+        return f"Unknown message type: {message_type}"
+    return None
+
+
+async def handle_connection(websocket):
+    """Serve one conversation for the lifetime of the connection."""
+    store = get_conversation_store()
+    session_id = None
+    if store:
+        query = parse_qs(urlsplit(websocket.request.path).query)
+        session_id = query.get("session", [None])[0]
+    # Restoring a stored session reads (and may write) the database
+    engine = await asyncio.to_thread(VoiceEngine, EngineConfig.from_env(session_id=session_id), store=store)
+    await send_config(websocket, engine, "ready")
+    try:
+        async for frame in websocket:
+            if isinstance(frame, bytes):
+                # Binary frames are raw WAV recordings
+                error = await handle_audio(websocket, engine, frame)
+            else:
+                try:
+                    message = json.loads(frame)
+                except json.JSONDecodeError:
+                    message = None
+                if not isinstance(message, dict):
+                    error = "Messages must be JSON objects"
+                else:
+                    error = await handle_message(websocket, engine, message)
+            if error:
+                await send(websocket, "error", message=error)
+    except ConnectionClosed:
+        pass
+
+
+async def run_server(host, port, max_message_bytes):
+    async with serve(handle_connection, host, port, max_size=max_message_bytes) as server:
+        logger.info("Voice assistant server listening on ws://%s:%s", host, port)
+        await server.serve_forever()
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--max-message-mb", type=float, default=16,
+                        help="largest accepted message, e.g. a WAV recording")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(run_server(args.host, args.port, int(args.max_message_mb * 1024 * 1024)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+"""Byte budgets for what each browser session keeps in memory.
+
+Every session stores its reply audio so the latest reply can be replayed on
+reruns without another TTS call, plus the conversation text. Without limits
+this grows with every turn in every open tab. Each session's audio and
+message text now share a per-session budget, and all sessions share a global
+one. When either is exceeded the oldest audio is dropped; it is
+resynthesized (usually from the TTS cache) if it is ever needed again.
+Message text is counted but never dropped.
+"""
+import hashlib
+import os
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+
+def recording_digest(audio_bytes):
+    """A short digest that identifies a recording without keeping its bytes."""
+    return hashlib.blake2b(audio_bytes, digest_size=16).hexdigest()
+
+
+def message_bytes(messages):
+    return sum(len(message["content"].encode("utf-8")) for message in messages)
+
+
+class SessionMemory:
+    """One session's reply audio, keyed by message index, within a byte budget."""
+
+    def __init__(self, budget_bytes, registry=None):
+        self.budget_bytes = budget_bytes
+        self.registry = registry
+        self._clips = OrderedDict()  # message index -> (clip, stored at)
+        self._lock = threading.Lock()
+        self.audio_bytes = 0
+        self.message_bytes = 0
+        self.evictions = 0
+        if registry is not None:
+            registry.register(self)
+
+    def get_audio(self, index):
+        with self._lock:
+            entry = self._clips.get(index)
+            return entry[0] if entry else None
+
+    def put_audio(self, index, clip):
+        with self._lock:
+            if index in self._clips:
+                self.audio_bytes -= len(self._clips.pop(index)[0].data)
+            self._clips[index] = (clip, time.monotonic())
+            self.audio_bytes += len(clip.data)
+            # The newest clip is kept even if it alone is over budget
+            while len(self._clips) > 1 and self.audio_bytes + self.message_bytes > self.budget_bytes:
+                self._evict_oldest()
+        if self.registry is not None:
+            self.registry.enforce()
+
+    def update_messages(self, messages):
+        """Count the conversation's text against the budget."""
+        with self._lock:
+            self.message_bytes = message_bytes(messages)
+
+    def clear(self):
+        with self._lock:
+            self._clips.clear()
+            self.audio_bytes = 0
+            self.message_bytes = 0
+
+    def _evict_oldest(self):
+        _, (clip, _) = self._clips.popitem(last=False)
+        self.audio_bytes -= len(clip.data)
+        self.evictions += 1
+
+    def oldest(self):
+        """When the oldest clip was stored, or None if there are none."""
+        with self._lock:
+            if not self._clips:
+                return None
+            return next(iter(self._clips.values()))[1]
+
+    def evict_oldest(self):
+        with self._lock:
+            if self._clips:
+                self._evict_oldest()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "clips": len(self._clips),
+                "audio_bytes": self.audio_bytes,
+                "message_bytes": self.message_bytes,
+                "budget_bytes": self.budget_bytes,
+                "evictions": self.evictions,
+            }
+
+
+class MemoryBudget:
+    """The global budget across every live session's ``SessionMemory``.
+
+    Sessions are tracked weakly, so a closed tab's memory stops counting as
+    soon as Streamlit drops its session state.
+    """
+
+    def __init__(self, budget_bytes, session_budget_bytes):
+        self.budget_bytes = budget_bytes
+        self.session_budget_bytes = session_budget_bytes
+        self._sessions = weakref.WeakSet()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def new_session(self):
+        return SessionMemory(self.session_budget_bytes, registry=self)
+
+    def register(self, session):
+        with self._lock:
+            self._sessions.add(session)
+
+    def _used(self, sessions):
+        return sum(session.audio_bytes + session.message_bytes for session in sessions)
+
+    def enforce(self):
+        """Drop the oldest audio across all sessions until the total fits."""
+        with self._lock:
+            sessions = list(self._sessions)
+            while self._used(sessions) > self.budget_bytes:
+                stored = [(session.oldest(), session) for session in sessions]
+                stored = [(when, session) for when, session in stored if when is not None]
+                if not stored:
+                    break
+                min(stored, key=lambda item: item[0])[1].evict_oldest()
+                self.evictions += 1
+
+    def largest_sessions(self, limit=5):
+        """Stats of the sessions using the most memory, largest first."""
+        with self._lock:
+            sessions = list(self._sessions)
+        stats = [session.stats() for session in sessions]
+        stats.sort(key=lambda item: item["audio_bytes"] + item["message_bytes"], reverse=True)
+        return stats[:limit]
+
+    def stats(self):
+        with self._lock:
+            sessions = list(self._sessions)
+        return {
+            "sessions": len(sessions),
+            "audio_bytes": sum(session.audio_bytes for session in sessions),
+            "message_bytes": sum(session.message_bytes for session in sessions),
+            "budget_bytes": self.budget_bytes,
+            "evictions": self.evictions,
+        }
+
+
+_budget = None
+_budget_lock = threading.Lock()
+
+
+def get_memory_budget():
+    """Return the process-wide budget.
+
+    Sized by ``SESSION_MEMORY_MB`` per session and ``MEMORY_BUDGET_MB`` across
+    all sessions.
+    """
+    global _budget
+    with _budget_lock:
+        if _budget is None:
+            _budget = MemoryBudget(
+                budget_bytes=int(float(os.getenv("MEMORY_BUDGET_MB", "256")) * 1024 * 1024),
+                session_budget_bytes=int(float(os.getenv("SESSION_MEMORY_MB", "8")) * 1024 * 1024)
+            )
+        return _budget
@@ -0,0 +1,174 @@
+"""Sentence-level streaming helpers for spoken replies.
+
+Gemini streams the reply in arbitrary text chunks. These helpers cut that
+stream into sentences as soon as they are complete, synthesize each sentence
+in the background, and hand the audio segments back in order so the first
+sentence can start playing while the rest of the reply is still being
+generated.
+"""
+import re
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from audio_output import clip_duration
+
+# A sentence ends at ., ! or ? (optionally followed by closing quotes or
+# brackets) and whitespace, or at a line break.
+SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?])["\')\]]*\s+|\n+')
+
+# Periods that don't end a sentence: list markers ("1.", "b.") at the start
+# of a line, and initials, dotted abbreviations ("e.g.", "U.S.") and titles
+LIST_MARKER = re.compile(r'(?:^|\n)[ \t]*(?:\d+|[A-Za-z])[.)]$')
+ABBREVIATION = re.compile(r'(?:\b[A-Za-z]\.)+$|\b(?:Mr|Mrs|Ms|Dr|Prof|Sr|Jr|St|vs|approx)\.$', re.IGNORECASE)
+
+
+def sentence_ends(text):
+    """Yield the ``SENTENCE_BOUNDARY`` matches in ``text`` that really end a sentence."""
+    for match in SENTENCE_BOUNDARY.finditer(text):
+        # Markers and abbreviations are short, so only look just before the period
+        before = max(match.start() - 16, 0)
+        if LIST_MARKER.search(text, before, match.start()) or ABBREVIATION.search(text, before, match.start()):
+            continue
+        yield match
+
+
+# Shared by every session so a burst of replies can't spawn unbounded threads
+_TTS_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="tts")
+
+
+class SentenceSplitter:
+    """Incrementally split streamed text into complete sentences."""
+
+    def __init__(self, min_chars=20):
+        # Very short fragments ("Sure!", "Hey.") are merged into the next
+        # sentence so we don't pay a TTS round-trip for a single word
+        self.min_chars = min_chars
+        self._buffer = ""
+
+    def feed(self, text):
+        """Add a chunk of text and return any sentences it completed."""
+        self._buffer += text
+        sentences = []
+        start = 0
+        for match in sentence_ends(self._buffer):
+            candidate = self._buffer[start:match.end()].strip()
+            if len(candidate) >= self.min_chars:
+                sentences.append(candidate)
+                start = match.end()
+        self._buffer = self._buffer[start:]
+        return sentences
+
+    def flush(self):
+        """Return whatever text is left once the stream has finished."""
+        remainder = self._buffer.strip()
+        self._buffer = ""
+        return [remainder] if remainder else []
+
+
+class SentenceBudget:
+    """Cut a streamed reply off once it has ``max_sentences`` complete sentences.
+
+    Sentences are counted as ``SentenceSplitter`` groups them, so fragments
+    shorter than ``min_chars`` are merged into the next one.
+    """
+
+    def __init__(self, max_sentences=None, min_chars=20):
+        self.max_sentences = max_sentences
+        self.min_chars = min_chars
+        self.text = ""
+        self.exhausted = False
+
+    def feed(self, chunk):
+        """Return the part of ``chunk`` that fits in the budget."""
+        if self.max_sentences is None:
+            self.text += chunk
+            return chunk
+        if self.exhausted:
+            return ""
+        start = len(self.text)
+        self.text += chunk
+        sentences = 0
+        sentence_start = 0
+        for match in sentence_ends(self.text):
+            if len(self.text[sentence_start:match.end()].strip()) < self.min_chars:
+                continue
+            sentences += 1
+            sentence_start = match.end()
+            if sentences == self.max_sentences:
+                # Keep closing quotes/brackets, drop the whitespace
+                self.text = self.text[:match.start() + len(match.group().rstrip())]
+                self.exhausted = True
+                break
+        return self.text[start:]
+
+
+class SentenceSpeech:
+    """Synthesize sentences concurrently and release the audio in order."""
+
+    def __init__(self, synthesize, executor=None):
+        self.synthesize = synthesize
+        self.executor = executor or _TTS_EXECUTOR
+        self.errors = []
+        self._pending = deque()
+
+    def submit(self, sentence):
+        self._pending.append(self.executor.submit(self.synthesize, sentence))
+
+    @property
+    def pending(self):
+        return len(self._pending)
+
+    def _result(self, future):
+        try:
+            return future.result()
+        except Exception as e:
+            # A failed sentence is skipped; the text reply is still shown
+            self.errors.append(e)
+            return None
+
+    def ready(self):
+        """Yield audio for the leading sentences that are already synthesized."""
+        while self._pending and self._pending[0].done():
+            audio = self._result(self._pending.popleft())
+            if audio:
+                yield audio
+
+    def drain(self):
+        """Yield audio for every remaining sentence, waiting as needed."""
+        while self._pending:
+            audio = self._result(self._pending.popleft())
+            if audio:
+                yield audio
+
+
+class PlaybackCursor:
+    """Track which of a growing list of audio segments should be playing.
+
+    The browser can't queue clips for us, so we remember when the current
+    segment should finish and only move on to the next one after that. The
+    cursor is polled, so it can live in session state across reruns.
+    """
+
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.index = -1
+        self.first_played = None
+        self._ends_at = 0.0
+
+    def advance(self, segments):
+        """Move to the next segment if the current one has finished playing.
+
+        Returns the index of the segment that should be playing, or -1.
+        """
+        now = self.clock()
+        if self.index + 1 < len(segments) and now >= self._ends_at:
+            self.index += 1
+            if self.first_played is None:
+                self.first_played = now
+            self._ends_at = now + clip_duration(segments[self.index])
+        return self.index
+
+    def finished(self, segments):
+        """True once every segment in ``segments`` has played to the end."""
+        return self.index == len(segments) - 1 and self.clock() >= self._ends_at
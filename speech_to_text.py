@@ -0,0 +1,205 @@
+"""Speech recognition engines and the fallback router that picks between them.
+
+``STT_ENGINES`` lists engines in the order they are tried, e.g.
+``vosk,google`` to recognize locally and only fall back to Google when the
+local engine is unavailable. Engines:
+
+- ``google``: the Google Web Speech API, sent through the shared HTTP pool,
+  rate limiter and circuit breaker, with the audio encoded to FLAC
+  in-process where possible (see ``flac_encoder``)
+- ``sphinx``: CMU PocketSphinx via SpeechRecognition (``pip install pocketsphinx``)
+- ``vosk``: Vosk/Kaldi (``pip install vosk``, model directory in ``VOSK_MODEL_PATH``)
+
+Errors are the usual ``sr.RequestError`` and ``sr.UnknownValueError``.
+SpeechRecognition itself is imported by the first recognition, so the router's
+stats can be shown before anyone has spoken.
+"""
+import json
+import os
+import threading
+import time
+
+from http_pool import get_http_pool
+from rate_limit import INTERACTIVE, get_scheduler
+from resilience import CircuitOpenError, LatencyTracker, get_backend
+from tracing import maybe_span
+
+GOOGLE_ENDPOINT = "https://www.google.com/speech-api/v2/recognize"
+
+
+def recognize_google(recognizer, audio_data, language="en-US", key=None):
+    """Transcribe ``audio_data`` with the Google Web Speech API over the shared pool."""
+    import requests
+    import speech_recognition as sr
+
+    from flac_encoder import flac_data
+
+    try:
+        from speech_recognition.recognizers.google import OutputParser, RequestBuilder, create_request_builder
+    except ImportError:
+        # Older SpeechRecognition releases; fall back to their urllib request
+        return recognizer.recognize_google(audio_data, key=key, language=language, show_all=False)
+
+    builder = create_request_builder(endpoint=GOOGLE_ENDPOINT, key=key, language=language)
+    # builder.build would always run the flac binary
+    data = flac_data(audio_data, convert_rate=RequestBuilder.to_convert_rate(audio_data.sample_rate))
+    try:
+        response = get_http_pool().post(
+            builder.build_url(),
+            data=data,
+            headers=builder.build_headers(audio_data),
+            timeout=recognizer.operation_timeout
+        )
+    except requests.exceptions.RequestException as e:
+        raise sr.RequestError(f"recognition connection failed: {e}")
+    if not response.ok:
+        error = sr.RequestError(f"recognition request failed: {response.reason}")
+        # Lets the rate limiter read Retry-After
+        error.response = response
+        raise error
+
+    return OutputParser(show_all=False, with_confidence=False).parse(response.text)
+
+
+class GoogleEngine:
+    """Remote recognition; one network round-trip per utterance."""
+
+    name = "google"
+
+    def recognize(self, recognizer, audio_data, language, trace=None):
+        import speech_recognition as sr
+
+        return get_backend("stt").call(
+            lambda: get_scheduler().call(
+                "stt", lambda: recognize_google(recognizer, audio_data, language=language), INTERACTIVE, trace
+            ),
+            trace,
+            ignore=(sr.UnknownValueError,)
+        )
+
+
+class SphinxEngine:
+    """Offline recognition with PocketSphinx; fast, but less accurate."""
+
+    name = "sphinx"
+
+    def recognize(self, recognizer, audio_data, language, trace=None):
+        # SpeechRecognition reports a missing pocketsphinx as a RequestError
+        return recognizer.recognize_sphinx(audio_data, language=language)
+
+
+class VoskEngine:
+    """Offline recognition with a Vosk model, loaded once per process."""
+
+    name = "vosk"
+
+    def __init__(self, model_path=None):
+        self.model_path = model_path or os.getenv("VOSK_MODEL_PATH", "model")
+        self._model = None
+        self._lock = threading.Lock()
+
+    def _load_model(self):
+        import speech_recognition as sr
+
+        with self._lock:
+            if self._model is None:
+                try:
+                    from vosk import Model, SetLogLevel
+                except ImportError:
+                    raise sr.RequestError("missing vosk module: ensure that vosk is set up correctly.")
+                if not os.path.isdir(self.model_path):
+                    raise sr.RequestError(f"Vosk model not found at {self.model_path}")
+                SetLogLevel(-1)
+                self._model = Model(self.model_path)
+            return self._model
+
+    def recognize(self, recognizer, audio_data, language, trace=None):
+        import speech_recognition as sr
+
+        model = self._load_model()
+        from vosk import KaldiRecognizer
+
+        kaldi = KaldiRecognizer(model, audio_data.sample_rate)
+        kaldi.AcceptWaveform(audio_data.get_raw_data(convert_width=2))
+        text = json.loads(kaldi.FinalResult()).get("text", "")
+        if not text:
+            raise sr.UnknownValueError()
+        return text
+
+
+ENGINES = {
+    "google": GoogleEngine,
+    "sphinx": SphinxEngine,
+    "vosk": VoskEngine,
+}
+
+
+class STTRouter:
+    """Try engines in order, falling back when one is unavailable.
+
+    Only engine failures (network errors, open circuits, missing packages or
+    models) move on to the next engine. Audio that an engine heard but could
+    not understand is reported as is, since another engine is unlikely to do
+    better and would only add latency.
+    """
+
+    def __init__(self, engines):
+        self.engines = list(engines)
+        self._lock = threading.Lock()
+        self._latency = {engine.name: LatencyTracker() for engine in self.engines}
+        self._counts = {engine.name: {"calls": 0, "failures": 0} for engine in self.engines}
+
+    def _count(self, name, key):
+        with self._lock:
+            self._counts[name][key] += 1
+
+    def transcribe(self, recognizer, audio_data, language="en-US", trace=None):
+        """Return the transcript from the first engine that is available."""
+        import speech_recognition as sr
+
+        audio_ms = len(audio_data.frame_data) * 1000 // (audio_data.sample_rate * audio_data.sample_width)
+        last_error = None
+        for engine in self.engines:
+            self._count(engine.name, "calls")
+            started = time.perf_counter()
+            try:
+                with maybe_span(trace, "stt.recognize", engine=engine.name, audio_ms=audio_ms):
+                    text = engine.recognize(recognizer, audio_data, language, trace)
+            except sr.UnknownValueError:
+                self._latency[engine.name].record(time.perf_counter() - started)
+                raise
+            except (sr.RequestError, CircuitOpenError, OSError) as e:
+                self._count(engine.name, "failures")
+                last_error = e
+                continue
+            self._latency[engine.name].record(time.perf_counter() - started)
+            return text
+        raise last_error
+
+    def stats(self):
+        stats = {}
+        for engine in self.engines:
+            p50 = self._latency[engine.name].percentile(50)
+            p95 = self._latency[engine.name].percentile(95)
+            with self._lock:
+                stats[engine.name] = dict(self._counts[engine.name])
+            stats[engine.name]["p50_ms"] = round(p50 * 1000) if p50 is not None else None
+            stats[engine.name]["p95_ms"] = round(p95 * 1000) if p95 is not None else None
+        return stats
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def get_stt_router():
+    """Return the process-wide router, ordered by ``STT_ENGINES`` (default ``google``)."""
+    global _router
+    with _router_lock:
+        if _router is None:
+            names = [name.strip() for name in os.getenv("STT_ENGINES", "google").split(",") if name.strip()]
+            unknown = [name for name in names if name not in ENGINES]
+            if unknown:
+                raise ValueError(f"Unknown STT engine(s): {', '.join(unknown)}")
+            _router = STTRouter(ENGINES[name]() for name in names)
+        return _router
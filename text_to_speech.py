@@ -0,0 +1,174 @@
+"""Speech synthesis for assistant replies.
+
+Kept free of Streamlit so it can run on background threads and be driven by
+the benchmarks. Errors are raised to the caller, which decides how to show
+them.
+
+``TTS_ENGINE`` picks the synthesizer: ``gtts`` (Google, MP3, default) or
+``espeak`` (espeak-ng running locally, WAV, no network round-trip). gTTS and
+requests are imported by the first gTTS request.
+"""
+import base64
+import io
+import logging
+import os
+import re
+import shutil
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from audio_output import MP3, WAV, AudioClip
+from http_pool import get_http_pool
+from rate_limit import INTERACTIVE, get_scheduler
+from resilience import get_backend
+from tracing import maybe_span
+from tts_cache import get_tts_cache
+
+
+# gTTS sends one request per ~100 characters; long replies fetch their
+# pieces concurrently, bounded across all sessions by this pool
+CHUNK_WORKERS = int(os.getenv("TTS_CHUNK_WORKERS", "8"))
+_CHUNK_EXECUTOR = ThreadPoolExecutor(max_workers=CHUNK_WORKERS, thread_name_prefix="gtts-chunk")
+
+AUDIO_LINE = re.compile(r'jQ1olc","\[\\"(.*)\\"]')
+
+
+def fetch_chunk(tts, request):
+    """Send one prepared gTTS request and return its decoded MP3 bytes."""
+    import requests
+    from gtts.tts import gTTSError
+
+    try:
+        response = get_http_pool().send(request, timeout=tts.timeout)
+        response.raise_for_status()
+    except requests.exceptions.HTTPError:
+        raise gTTSError(tts=tts, response=response)
+    except requests.exceptions.RequestException:
+        raise gTTSError(tts=tts)
+
+    audio = bytearray()
+    for line in response.iter_lines(chunk_size=1024):
+        decoded_line = line.decode("utf-8")
+        if "jQ1olc" in decoded_line:
+            match = AUDIO_LINE.search(decoded_line)
+            if not match:
+                # Good response, but no audio in it
+                raise gTTSError(tts=tts, response=response)
+            audio += base64.b64decode(match.group(1).encode("ascii"))
+    return bytes(audio)
+
+
+def _fetch_chunk_limited(tts, request, priority, trace):
+    # One rate limit token per HTTP request; a 429 retries just this piece
+    return get_scheduler().call("tts", lambda: fetch_chunk(tts, request), priority, trace)
+
+
+def _gtts_request(text, priority=INTERACTIVE, trace=None):
+    from gtts import gTTS
+
+    # Generate TTS audio with natural voice settings
+    # Use a more conversational speaking style
+    tts = gTTS(text=text, lang='en', slow=False, tld='com')
+
+    try:
+        requests_to_send = tts._prepare_requests()
+    except AttributeError:
+        requests_to_send = None
+    if not requests_to_send:
+        # Unknown gTTS internals; let it fetch the pieces one after another
+        def write():
+            audio_bytes = io.BytesIO()
+            tts.write_to_fp(audio_bytes)
+            return audio_bytes.getvalue()
+
+        return get_scheduler().call("tts", write, priority, trace)
+
+    if len(requests_to_send) == 1:
+        return _fetch_chunk_limited(tts, requests_to_send[0], priority, trace)
+    # MP3 frames can simply be concatenated, so join the pieces in text order
+    pieces = [
+        _CHUNK_EXECUTOR.submit(_fetch_chunk_limited, tts, request, priority, trace)
+        for request in requests_to_send
+    ]
+    return b"".join(piece.result() for piece in pieces)
+
+
+def fetch_gtts_audio(text, trace=None, priority=INTERACTIVE):
+    """Convert text to MP3 bytes with gTTS within the shared TTS rate limit.
+
+    Every piece gTTS sends takes its own rate limit token, and a 429 is
+    retried by the scheduler, with jittered exponential backoff, for that
+    piece only. The TTS circuit breaker raises ``CircuitOpenError`` right
+    away while gTTS is failing, and slow requests are hedged when enabled.
+    """
+    return get_backend("tts").call(lambda: _gtts_request(text, priority, trace), trace)
+
+
+class GTTSBackend:
+    """Google Translate's TTS endpoint; natural voice, one round-trip per ~100 characters."""
+
+    name = "gtts"
+    mime = MP3
+
+    def cache_key(self, cache, text):
+        return cache.key(text, lang='en', tld='com', slow=False)
+
+    def synthesize(self, text, trace=None, priority=INTERACTIVE):
+        return fetch_gtts_audio(text, trace, priority)
+
+
+class EspeakBackend:
+    """espeak-ng on this machine; robotic, but fast and offline."""
+
+    name = "espeak"
+    mime = WAV
+
+    def __init__(self, executable, voice="en-us", words_per_minute=175):
+        self.executable = executable
+        self.voice = voice
+        self.words_per_minute = words_per_minute
+
+    def cache_key(self, cache, text):
+        return cache.key(text, engine=self.name, voice=self.voice, rate=self.words_per_minute)
+
+    def synthesize(self, text, trace=None, priority=INTERACTIVE):
+        result = subprocess.run(
+            [self.executable, "--stdout", "-v", self.voice, "-s", str(self.words_per_minute), text],
+            capture_output=True, timeout=30
+        )
+        if result.returncode != 0 or not result.stdout:
+            raise RuntimeError(f"espeak-ng failed: {result.stderr.decode(errors='replace').strip()}")
+        return result.stdout
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_tts_engine():
+    """Return the process-wide TTS backend selected by ``TTS_ENGINE``.
+
+    Falls back to gTTS when espeak-ng isn't installed.
+    """
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = GTTSBackend()
+            if os.getenv("TTS_ENGINE", "gtts") == "espeak":
+                executable = shutil.which("espeak-ng") or shutil.which("espeak")
+                if executable:
+                    _engine = EspeakBackend(executable, voice=os.getenv("ESPEAK_VOICE", "en-us"))
+                else:
+                    logging.getLogger(__name__).warning("TTS_ENGINE=espeak but espeak-ng is not installed; using gTTS")
+        return _engine
+
+
+def synthesize_speech(text, trace=None, cache=None, priority=INTERACTIVE, engine=None):
+    """Convert text to an ``AudioClip``, shared across sessions through the TTS cache."""
+    cache = cache or get_tts_cache()
+    engine = engine or get_tts_engine()
+    key = engine.cache_key(cache, text)
+    with maybe_span(trace, "tts.synthesize", chars=len(text), engine=engine.name):
+        audio = cache.get_or_synthesize(key, lambda: engine.synthesize(text, trace, priority), engine.mime)
+    return AudioClip(audio, engine.mime)
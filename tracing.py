@@ -0,0 +1,108 @@
+"""Per-turn latency tracing.
+
+Every conversation turn gets a ``TurnTrace`` with a turn ID and a list of
+timed spans (transcription, Gemini time-to-first-chunk, TTS, rendering...).
+Spans may be recorded from background threads. Finished turns can be shown
+in the sidebar debug panel and appended to a JSONL file for offline analysis.
+"""
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+
+class TurnTrace:
+    """Timed spans for one conversation turn."""
+
+    def __init__(self, kind, started=None):
+        self.turn_id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.timestamp = time.time()
+        # All span times are perf_counter() values relative to this origin
+        self.started = started if started is not None else time.perf_counter()
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add(self, name, start, end, **attrs):
+        """Record a span measured with ``time.perf_counter()``."""
+        span = {
+            "name": name,
+            "start_ms": round((start - self.started) * 1000, 1),
+            "duration_ms": round((end - start) * 1000, 1),
+        }
+        span.update(attrs)
+        with self._lock:
+            self.spans.append(span)
+
+    @contextmanager
+    def span(self, name, **attrs):
+        """Time the body of a ``with`` block as a span."""
+        start = time.perf_counter()
+        try:
+            yield attrs
+        finally:
+            self.add(name, start, time.perf_counter(), **attrs)
+
+    def total_ms(self):
+        with self._lock:
+            return max((s["start_ms"] + s["duration_ms"] for s in self.spans), default=0.0)
+
+    def to_dict(self):
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s["start_ms"])
+        return {
+            "turn_id": self.turn_id,
+            "kind": self.kind,
+            "timestamp": self.timestamp,
+            "total_ms": self.total_ms(),
+            "spans": spans,
+        }
+
+
+@contextmanager
+def maybe_span(trace, name, **attrs):
+    """``trace.span(...)`` that does nothing when there is no trace."""
+    if trace is None:
+        yield attrs
+    else:
+        with trace.span(name, **attrs) as span_attrs:
+            yield span_attrs
+
+
+class Tracer:
+    """Collects finished turns and optionally appends them to a JSONL file."""
+
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def start_turn(self, kind, started=None):
+        return TurnTrace(kind, started=started)
+
+    def finish(self, trace):
+        """Close a turn and return its dict form."""
+        record = trace.to_dict()
+        if self.path:
+            line = json.dumps(record)
+            with self._lock:
+                try:
+                    with open(self.path, "a", encoding="utf-8") as f:
+                        f.write(line + "\n")
+                except OSError:
+                    pass  # Tracing must never break a turn
+        return record
+
+
+_tracer = None
+_tracer_lock = threading.Lock()
+
+
+def get_tracer():
+    """Return the process-wide tracer, writing to ``TRACE_FILE`` if set."""
+    global _tracer
+    with _tracer_lock:
+        if _tracer is None:
+            _tracer = Tracer(path=os.getenv("TRACE_FILE") or None)
+        return _tracer
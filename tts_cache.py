@@ -0,0 +1,257 @@
+"""Process-wide, content-addressed cache for synthesized speech.
+
+Audio is keyed by a hash of everything that affects the output (text,
+language, accent and speed), so identical greetings, error messages and
+common answers are synthesized once and shared by every session. The cache
+is bounded in bytes with LRU eviction, can persist to a directory (with its
+own byte cap, also LRU), and coalesces concurrent requests for the same text
+into a single synthesis.
+"""
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from audio_output import MP3, OGG, WAV
+
+# File name extension for each audio format the cache stores
+EXTENSIONS = {MP3: ".mp3", WAV: ".wav", OGG: ".ogg"}
+
+
+class TTSCache:
+    """Byte-bounded LRU cache of audio with single-flight synthesis.
+
+    Files on disk are named after the key and the audio's MIME type. The
+    directory is kept under ``max_disk_bytes`` by removing the least
+    recently used files this process knows of, starting from what was
+    there when it started.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, directory=None, max_disk_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._files = OrderedDict()  # path -> size, least recently used first
+        self._disk_bytes = 0
+        self._disk_lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.disk_evictions = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self._scan_disk()
+
+    @staticmethod
+    def key(text, lang="en", tld="com", slow=False, engine="gtts", voice=None, rate=None):
+        """Content address for the audio of ``text`` with the given engine and voice settings.
+
+        gTTS output depends on ``lang``, ``tld`` and ``slow``; other engines'
+        on their ``voice`` and speaking ``rate``.
+        """
+        if engine == "gtts":
+            parts = [text, lang, tld, "slow" if slow else "normal"]
+        else:
+            parts = [text, engine, voice or "", str(rate)]
+        payload = "\0".join(parts)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key, mime=MP3):
+        """Return cached ``mime`` audio for ``key`` or None, without counting a miss."""
+        with self._lock:
+            audio = self._entries.get(key)
+            if audio is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return audio
+
+        audio = self._read_disk(key, mime)
+        if audio is not None:
+            with self._lock:
+                self.disk_hits += 1
+                self._store(key, audio)
+        return audio
+
+    def put(self, key, audio, mime=MP3):
+        with self._lock:
+            self._store(key, audio)
+        self._write_disk(key, audio, mime)
+
+    def get_or_synthesize(self, key, synthesize, mime=MP3):
+        """Return audio for ``key``, calling ``synthesize()`` at most once per key.
+
+        Callers asking for a key that is already being synthesized wait for
+        that result instead of starting their own request.
+        """
+        audio = self.get(key, mime)
+        if audio is not None:
+            return audio
+
+        with self._lock:
+            # Another caller may have finished synthesizing since our lookup
+            audio = self._entries.get(key)
+            if audio is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return audio
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            return future.result()
+
+        try:
+            audio = synthesize()
+            self.put(key, audio, mime)
+            future.set_result(audio)
+            return audio
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+
+    def _store(self, key, audio):
+        # Caller holds the lock
+        if len(audio) > self.max_bytes:
+            return
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._bytes -= len(previous)
+        self._entries[key] = audio
+        self._bytes += len(audio)
+        while self._bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= len(evicted)
+            self.evictions += 1
+
+    def _path(self, key, mime):
+        return os.path.join(self.directory, key[:2], key + EXTENSIONS.get(mime, ".bin"))
+
+    def _scan_disk(self):
+        """Index the files already in the directory, oldest first."""
+        files = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, path, stat.st_size))
+        with self._disk_lock:
+            for _, path, size in sorted(files):
+                self._files[path] = size
+                self._disk_bytes += size
+            self._trim_disk()
+
+    def _trim_disk(self):
+        # Caller holds the disk lock
+        while self._disk_bytes > self.max_disk_bytes and self._files:
+            path, size = self._files.popitem(last=False)
+            self._disk_bytes -= size
+            self.disk_evictions += 1
+            try:
+                os.remove(path)
+            except OSError:
+                pass  # Already removed, e.g. by another process
+
+    def _read_disk(self, key, mime):
+        if not self.directory:
+            return None
+        path = self._path(key, mime)
+        try:
+            with open(path, "rb") as f:
+                audio = f.read()
+        except OSError:
+            return None
+        try:
+            # The next process orders its index by modification time
+            os.utime(path)
+        except OSError:
+            pass
+        with self._disk_lock:
+            if path in self._files:
+                self._files.move_to_end(path)
+        return audio
+
+    def _write_disk(self, key, audio, mime):
+        if not self.directory or len(audio) > self.max_disk_bytes:
+            return
+        path = self._path(key, mime)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write to a temp file first so readers never see a partial file
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(audio)
+            os.replace(temp_path, path)
+        except OSError:
+            return  # The in-memory copy is still usable
+        with self._disk_lock:
+            self._disk_bytes += len(audio) - self._files.pop(path, 0)
+            self._files[path] = len(audio)
+            self._trim_disk()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits = self.disk_hits = self.misses = self.coalesced = self.evictions = 0
+        with self._disk_lock:
+            self.disk_evictions = 0
+
+    def stats(self):
+        with self._disk_lock:
+            disk = {"disk_bytes": self._disk_bytes, "disk_evictions": self.disk_evictions}
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                **disk,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_tts_cache():
+    """Return the cache shared by every session in this process.
+
+    Configured from ``TTS_CACHE_MAX_MB``, ``TTS_CACHE_DIR`` and
+    ``TTS_CACHE_DISK_MB`` on first use.
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            max_mb = float(os.getenv("TTS_CACHE_MAX_MB", "64"))
+            _cache = TTSCache(
+                max_bytes=int(max_mb * 1024 * 1024),
+                directory=os.getenv("TTS_CACHE_DIR") or None,
+                max_disk_bytes=int(float(os.getenv("TTS_CACHE_DISK_MB", "256")) * 1024 * 1024)
+            )
+        return _cache
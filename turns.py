@@ -0,0 +1,423 @@
+"""Conversation turns executed as jobs on a bounded background worker pool.
+
+A turn (transcription, Gemini generation and sentence-by-sentence TTS) runs
+on a worker thread instead of inside the Streamlit script run, so a slow turn
+doesn't freeze the page or hold a server thread for its whole duration. The
+page polls the ``TurnJob`` and renders partial results as they land.
+
+Nothing here touches ``st.session_state``: everything a turn needs is passed
+in, and problems are reported on the job as notices for the page to show.
+
+The speech recognition stack (SpeechRecognition, NumPy and the STT engines)
+is imported by the first voice turn, so text-only use never loads it.
+"""
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from audio_output import compact_audio
+from rate_limit import INTERACTIVE, get_scheduler
+from resilience import CircuitOpenError
+from response_cache import get_response_cache
+from speech_pipeline import SentenceBudget, SentenceSplitter, SentenceSpeech
+from text_to_speech import synthesize_speech
+from tracing import maybe_span
+
+# Response length presets: guidance appended to the personality prompt, the
+# generation config sent with each message, and a sentence budget after which
+# we stop reading the stream. Token limits are generous because Gemini 2.5
+# counts its thinking tokens against max_output_tokens; the sentence budget is
+# what keeps replies (and their TTS) short. Budgets leave headroom above the
+# instructed length, so they only stop replies that ignore it.
+LENGTH_PRESETS = {
+    "Short": {
+        "instruction": "IMPORTANT: Keep responses VERY brief - aim for 1-3 sentences maximum. Be direct and concise.",
+        "max_output_tokens": 1024,
+        "temperature": 0.6,
+        "max_sentences": 5
+    },
+    "Medium": {
+        "instruction": "Keep responses moderate - around 3-5 sentences. Balance brevity with completeness.",
+        "max_output_tokens": 1536,
+        "temperature": 0.7,
+        "max_sentences": 8
+    },
+    "Long": {
+        "instruction": "Provide detailed, comprehensive responses - 6+ sentences. Include explanations, examples, and context.",
+        "max_output_tokens": 2048,
+        "temperature": 0.8,
+        "max_sentences": 16
+    }
+}
+
+
+def generation_config(response_length):
+    """The Gemini generation config for a length preset, as the dict ``send_message`` accepts."""
+    preset = LENGTH_PRESETS[response_length]
+    return {
+        "candidate_count": 1,
+        "max_output_tokens": preset["max_output_tokens"],
+        "temperature": preset["temperature"]
+    }
+
+# Job states, in the order a turn goes through them
+QUEUED = "queued"
+TRANSCRIBING = "transcribing"
+GENERATING = "generating"
+DONE = "done"
+
+
+class TurnJob:
+    """One conversation turn and everything it has produced so far."""
+
+    def __init__(self, kind, prompt=None, audio_bytes=None, trace=None, on_update=None):
+        self.job_id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.audio_bytes = audio_bytes
+        self.trace = trace
+        # Called from the worker thread after every change, so push-based
+        # clients don't have to poll; it must be quick and must not block
+        self.on_update = on_update
+        # Conversation generation, set by the engine that runs the turn
+        self.generation = None
+        self.submitted = time.perf_counter()
+        self.first_segment_at = None
+        self._lock = threading.Lock()
+        self._state = QUEUED
+        self._transcript = prompt
+        self._reply = ""
+        self._segments = []
+        self._audio = None
+        self._notices = []
+
+    def _updated(self):
+        if self.on_update is not None:
+            self.on_update()
+
+    def set_state(self, state):
+        with self._lock:
+            self._state = state
+        self._updated()
+
+    def set_transcript(self, text):
+        with self._lock:
+            self._transcript = text
+        self._updated()
+
+    def append_reply(self, text):
+        with self._lock:
+            self._reply += text
+        self._updated()
+
+    def add_segment(self, audio):
+        with self._lock:
+            if self.first_segment_at is None:
+                self.first_segment_at = time.perf_counter()
+            self._segments.append(audio)
+        self._updated()
+
+    def set_audio(self, clip):
+        """Store the whole reply's audio, encoded for keeping in the chat history."""
+        with self._lock:
+            self._audio = clip
+        self._updated()
+
+    def notify(self, level, message):
+        """Queue a message for the page, e.g. ``("warning", "...")``."""
+        with self._lock:
+            self._notices.append((level, message))
+        self._updated()
+
+    def snapshot(self):
+        """A consistent copy of the job's progress for rendering."""
+        with self._lock:
+            return {
+                "state": self._state,
+                "transcript": self._transcript,
+                "reply": self._reply,
+                "segments": list(self._segments),
+                "audio": self._audio,
+                "notices": list(self._notices),
+                "generation": self.generation,
+            }
+
+
+class TurnWorkerPool:
+    """A fixed number of turn workers with a bounded backlog."""
+
+    def __init__(self, max_workers=8, max_pending=32):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="turn")
+        self._slots = threading.BoundedSemaphore(max_workers + max_pending)
+        self._lock = threading.Lock()
+        self.active = 0
+        self.rejected = 0
+
+    def submit(self, job, fn):
+        """Run ``fn(job)`` on a worker; returns False if the backlog is full."""
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            return False
+
+        def run():
+            with self._lock:
+                self.active += 1
+            if job.trace:
+                job.trace.add("turn.queue_wait", job.submitted, time.perf_counter())
+            try:
+                fn(job)
+            except Exception as e:
+                job.notify("error", f"Error: {str(e)}")
+            finally:
+                job.set_state(DONE)
+                with self._lock:
+                    self.active -= 1
+                self._slots.release()
+
+        self._executor.submit(run)
+        return True
+
+    def stats(self):
+        with self._lock:
+            return {"workers": self.max_workers, "active": self.active, "rejected": self.rejected}
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_worker_pool():
+    """Return the process-wide pool, sized by ``TURN_WORKERS`` and ``TURN_QUEUE``."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = TurnWorkerPool(
+                max_workers=int(os.getenv("TURN_WORKERS", "8")),
+                max_pending=int(os.getenv("TURN_QUEUE", "32"))
+            )
+        return _pool
+
+
+def transcribe_recording(job, noise_floor, vad_stats):
+    """Convert the job's recorded audio to text using speech recognition."""
+    import speech_recognition as sr
+
+    from audio_input import decode_wav, to_mono, normalize, detect_speech, STT_SAMPLE_RATE
+    from speech_to_text import get_stt_router
+
+    trace = job.trace
+    try:
+        recognizer = sr.Recognizer()
+
+        # Adjust for ambient noise
+        recognizer.energy_threshold = 4000
+        recognizer.dynamic_energy_threshold = True
+
+        if not job.audio_bytes:
+            return None
+
+        # Parse the WAV recording in memory, then downmix and resample it to
+        # the rate the recognizer wants so we upload far fewer samples
+        with maybe_span(trace, "stt.preprocess"):
+            samples, sample_rate = decode_wav(job.audio_bytes)
+            if not len(samples):
+                job.notify("error", "Failed to read audio recording")
+                return None
+            mono = to_mono(samples, sample_rate, STT_SAMPLE_RATE)
+
+        # Calibrate from this session's noise-floor estimate instead of
+        # consuming the start of the recording as ambient noise
+        noise_floor.update(mono, STT_SAMPLE_RATE)
+        noise_floor.calibrate(recognizer)
+
+        # Trim leading/trailing silence and skip the STT call entirely when
+        # the recording has no speech in it
+        with maybe_span(trace, "stt.vad"):
+            speech = detect_speech(
+                mono,
+                STT_SAMPLE_RATE,
+                recognizer.energy_threshold,
+                dynamic=recognizer.dynamic_energy_threshold
+            )
+        if speech is None:
+            vad_stats["rejected"] += 1
+            job.notify("warning", "No speech detected. Please try again.")
+            return None
+        start, end = speech
+        vad_stats["trimmed_ms"] += (len(mono) - (end - start)) * 1000 // STT_SAMPLE_RATE
+        mono = mono[start:end]
+
+        pcm = normalize(mono)
+        audio_data = sr.AudioData(pcm.tobytes(), STT_SAMPLE_RATE, pcm.itemsize)
+
+        # Recognize with the configured engines, falling back in order
+        return get_stt_router().transcribe(recognizer, audio_data, language="en-US", trace=trace)
+
+    except CircuitOpenError:
+        job.notify("warning", "Speech recognition is temporarily unavailable. Please type your message instead.")
+        return None
+    except sr.UnknownValueError:
+        job.notify("error", "Could not understand audio. Please speak more clearly.")
+        return None
+    except sr.RequestError as e:
+        job.notify("error", f"Speech recognition error: {str(e)}. Please check your internet connection.")
+        return None
+    except Exception as e:
+        job.notify("error", f"Error processing audio: {str(e)}")
+        return None
+
+
+def generate_ai_response_stream(prompt, history, personality, personality_prompt, response_length,
+                                chat_manager, context, trace=None, generation=None):
+    """Generate AI response with streaming, yielding text chunks as they arrive.
+
+    ``generation`` is the conversation generation the turn belongs to; if the
+    conversation is reset meanwhile, the chat manager ignores this turn.
+    """
+    try:
+        # Identical first prompt of a fresh conversation: answer from the cache
+        # without touching the context window or Gemini. Later turns skip it,
+        # so a stored history is never read just to hash it.
+        cache = get_response_cache() if not history else None
+        cache_key = cache.key(personality, response_length, prompt, history) if cache else None
+        cached = cache.get(cache_key) if cache else None
+        if cached is not None:
+            if trace:
+                trace.add("llm.cache_hit", time.perf_counter(), time.perf_counter())
+            yield cached
+            return
+
+        # Build system instruction with response length guidance
+        full_prompt = f"{personality_prompt}\n\nResponse Length Guideline: {LENGTH_PRESETS[response_length]['instruction']}"
+
+        # Only recent turns are sent verbatim; older ones live in a rolling summary
+        recent_messages = context.window(history)
+
+        # Reuse the live chat session; it is only rebuilt when the personality,
+        # response length, summary or conversation changed since the last turn
+        chat = chat_manager.get_chat(
+            (personality, response_length, context.version),
+            context.system_instruction(full_prompt),
+            recent_messages,
+            generation
+        )
+
+        # Stream the response; send_message waits for the first chunk, so a
+        # 429 surfaces here and is retried before anything was streamed
+        requested = time.perf_counter()
+        config = generation_config(response_length)
+        response = get_scheduler().call(
+            "gemini", lambda: chat.send_message(prompt, stream=True, generation_config=config), INTERACTIVE, trace
+        )
+
+        # Stop reading once the preset's sentence budget is used up, so an
+        # overlong reply doesn't cost generation and TTS time
+        budget = SentenceBudget(LENGTH_PRESETS[response_length]["max_sentences"])
+        first_chunk = None
+        for chunk in response:
+            if first_chunk is None:
+                first_chunk = time.perf_counter()
+                if trace:
+                    trace.add("llm.first_chunk", requested, first_chunk)
+            # Chunks with only thinking, or a final one that ran out of
+            # tokens, have no parts, and reading their text raises
+            if chunk.parts and chunk.text:
+                text = budget.feed(chunk.text)
+                if text:
+                    yield text
+            if budget.exhausted:
+                break
+        if trace:
+            trace.add("llm.generate", requested, time.perf_counter(), truncated=budget.exhausted)
+        if not budget.text:
+            raise RuntimeError("Gemini returned no text. Please try again.")
+
+        if budget.exhausted:
+            # Let the server stop generating the rest of the reply
+            stream = getattr(response, "_iterator", None)
+            if hasattr(stream, "cancel"):
+                stream.cancel()
+            chat_manager.commit_truncated_turn(recent_messages, prompt, budget.text, generation)
+        else:
+            # The chat appended this exchange to its history once the stream finished
+            chat_manager.commit_turn(generation)
+        if cache:
+            cache.put(cache_key, budget.text)
+
+    except Exception as e:
+        # The chat history may be half-updated; rebuild it on the next turn
+        chat_manager.invalidate(generation)
+        error_msg = f"Error: {str(e)}"
+        yield error_msg
+
+
+def tts_error_notice(error):
+    """The ``(level, message)`` to show for a TTS failure; the text reply stays."""
+    if isinstance(error, CircuitOpenError):
+        return "warning", "Voice output is temporarily unavailable. Showing the text response only."
+    if "429" in str(error):
+        return "warning", "TTS rate limit reached. Audio generation temporarily unavailable. Text response is still available."
+    return "error", f"TTS Error: {str(error)}"
+
+
+def speak_reply(job, chunks):
+    """Stream reply text onto the job and synthesize it sentence by sentence.
+
+    Each finished sentence is sent to TTS right away, and its audio is added
+    to the job, in order, as soon as it is ready.
+    """
+    splitter = SentenceSplitter()
+    speech = SentenceSpeech(partial(synthesize_speech, trace=job.trace))
+
+    for chunk in chunks:
+        job.append_reply(chunk)
+        for sentence in splitter.feed(chunk):
+            speech.submit(sentence)
+        for audio in speech.ready():
+            job.add_segment(audio)
+
+    for sentence in splitter.flush():
+        speech.submit(sentence)
+    for audio in speech.drain():
+        job.add_segment(audio)
+
+    segments = job.snapshot()["segments"]
+    if segments:
+        job.set_audio(compact_audio(segments))
+
+    if speech.errors:
+        job.notify(*tts_error_notice(speech.errors[0]))
+
+
+def speak_text(job):
+    """Synthesize a finished reply again, e.g. after its audio was evicted.
+
+    ``job`` is a ``"speech"`` job whose transcript holds the reply text; the
+    audio and any TTS notices end up on the job like a turn's.
+    """
+    speak_reply(job, [job.snapshot()["transcript"]])
+
+
+def run_turn(job, history, personality, personality_prompt, response_length,
+             chat_manager, context, noise_floor, vad_stats, generation=None):
+    """Execute a whole turn on a worker thread."""
+    if job.kind == "voice":
+        job.set_state(TRANSCRIBING)
+        with maybe_span(job.trace, "stt.transcribe"):
+            transcript = transcribe_recording(job, noise_floor, vad_stats)
+        if not transcript:
+            return
+        job.set_transcript(transcript)
+    else:
+        transcript = job.snapshot()["transcript"]
+
+    job.set_state(GENERATING)
+    speak_reply(job, generate_ai_response_stream(
+        transcript, history, personality, personality_prompt, response_length,
+        chat_manager, context, job.trace, generation
+    ))